@@ -1,49 +1,229 @@
-from flask import Flask, render_template, request, jsonify, session, send_file, send_from_directory
-from yt_dlp import YoutubeDL
+from flask import Flask, Response, abort, g, request, jsonify, send_file, send_from_directory
+from werkzeug.exceptions import HTTPException
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 import os
 import json
-from concurrent.futures import ThreadPoolExecutor
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+import sqlite3
+import heapq
+import bisect
+import itertools
+import io
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import Counter, OrderedDict, deque
 import logging
 from datetime import datetime
-import webview
 import threading
 import sys
 import time
-import pystray
-from PIL import Image, ImageDraw
+import uuid
+import re
+import unicodedata
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import urllib.request
+import urllib.error
+from urllib.parse import urlparse, parse_qs
 
 app = Flask(__name__)
 app.secret_key = '1234567890'  # Add a secret key for session management
-executor = ThreadPoolExecutor(max_workers=10)  # Augmenté à 10 workers
+# Mode strict : relit chaque réponse JSON pour vérifier son format (débogage)
+app.config['STRICT_RESPONSES'] = os.environ.get('OPENPY_STRICT_RESPONSES') == '1'
+# Profilage à la demande (?profile=1), désactivé par défaut
+app.config['PROFILING'] = os.environ.get('OPENPY_PROFILING') == '1'
+
+class MeteredExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor qui compte ses tâches en attente, en cours et terminées"""
+
+    def __init__(self, max_workers, **kwargs):
+        super().__init__(max_workers=max_workers, **kwargs)
+        self.max_workers = max_workers
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self._counts_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._counts_lock:
+            self.queued += 1
+        return super().submit(self._run, fn, args, kwargs)
+
+    def _run(self, fn, args, kwargs):
+        with self._counts_lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._counts_lock:
+                self.running -= 1
+                self.completed += 1
+
+    def metrics(self):
+        with self._counts_lock:
+            return {
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'max_workers': self.max_workers
+            }
+
+executor = MeteredExecutor(max_workers=10)  # Augmenté à 10 workers
 
 # Define directories and files paths
 DOWNLOAD_DIR = os.path.join(os.path.dirname(__file__), 'downloads')
 CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+STREAM_DIR = os.path.join(DOWNLOAD_DIR, 'stream')
+PINNED_DIR = os.path.join(DOWNLOAD_DIR, 'pinned')
 PLAYLIST_FILE = os.path.join(os.path.dirname(__file__), 'playlists.json')
+PLAYLIST_DB = os.path.join(os.path.dirname(__file__), 'playlists.db')
+MATCH_CACHE_FILE = os.path.join(CACHE_DIR, 'matches.json')
 THEME_FILE = os.path.join(os.path.dirname(__file__), 'theme.json')
 STATS_FILE = os.path.join(os.path.dirname(__file__), 'stats.json')
+PINNED_FILE = os.path.join(os.path.dirname(__file__), 'pinned.json')
 
 # Create necessary directories
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 os.makedirs(CACHE_DIR, exist_ok=True)
+os.makedirs(STREAM_DIR, exist_ok=True)
+os.makedirs(PINNED_DIR, exist_ok=True)
 
 # Constants
 MAX_PLAYLIST_SIZE = 1000
 ALLOWED_AUDIO_FORMATS = ['m4a', 'mp3', 'wav']
-CACHE_TIMEOUT = 3600  # 1 hour
+CACHE_TIMEOUT = 3600  # 1 hour (si l'URL ne précise pas son expiration)
+PREFETCH_DEPTH = 3  # Morceaux suivants résolus à l'avance pendant la lecture d'une playlist
+PREFETCH_WORKERS = 2
+STREAM_SEGMENT_SIZE = 1024 * 1024  # Segments de 1 Mo récupérés à la demande
+STREAM_CACHE_MAX_SIZE = 2 * 1024 ** 3  # 2 Go de flux audio gardés sur disque
+PIN_WORKERS = 2  # Téléchargements hors-ligne simultanés
+PIN_QUOTA = 5 * 1024 ** 3  # 5 Go maximum pour les playlists hors-ligne
+SEARCH_RESULTS = 20  # Résultats YouTube récupérés en une fois, puis paginés localement
+SEARCH_PAGE_SIZE = 5
+SEARCH_CACHE_TTL = 600
+SEARCH_CACHE_SIZE = 200
+SEARCH_LOCAL_RESULTS = 5  # Morceaux de la bibliothèque placés avant les résultats YouTube
+SEARCH_SUGGEST_LIMIT = 10  # Suggestions locales pendant la saisie
+SEARCH_MIN_PREFIX = 2  # Un terme plus court ne correspond qu'à un mot entier
+SEARCH_INDEX_SCAN = 300  # Morceaux classés au plus par requête locale
+EXTRACTOR_POOL_SIZE = 4  # Instances YoutubeDL gardées au chaud par rôle
+EXTRACTOR_MAX_USES = 200  # Une instance est recréée après ce nombre d'appels
+NEGATIVE_CACHE_TTL = 30  # Une extraction en échec n'est pas retentée pendant 30 secondes
+STREAM_URL_MARGIN = 300  # URL googlevideo considérée expirée 5 minutes avant son échéance
 MAX_CACHE_SIZE = 100
+IMPORT_WORKERS = 4  # Recherches YouTube simultanées pendant un import Spotify
+IMPORT_BATCH_SIZE = 50  # Morceaux résolus ajoutés à la playlist en une seule modification
+PLAYLIST_CHANGELOG_SIZE = 1000  # Modifications gardées pour la synchronisation différentielle
+PLAYLIST_PAGE_SIZE = 500
+PLAYLIST_IMPORT_BATCH = 500  # Morceaux écrits par transaction pendant un import JSON lines
+EXPORT_CHUNK_SIZE = 64 * 1024  # Octets envoyés à la fois pendant un export
+SNAPSHOT_RENDER_LIMIT = 32  # Réponses JSON gardées par version (pages comprises)
+MAX_JOBS = 50  # Tâches conservées dans le registre (les plus anciennes terminées sont évincées)
+MATCH_CACHE_TTL = 30 * 86400  # Correspondances Spotify -> YouTube gardées 30 jours
+MATCH_CACHE_SIZE = 50000
+JOB_EVENTS_KEEPALIVE = 15  # Secondes entre deux commentaires keep-alive du flux SSE
+SERVER_THREADS = 32  # Threads du serveur HTTP (au-delà, les connexions attendent leur tour)
+SERVER_KEEPALIVE_TIMEOUT = 30  # Une connexion inactive libère son thread après 30 secondes
+# Requêtes d'extraction simultanées et en attente par endpoint, au-delà : 429.
+# Le total reste sous SERVER_THREADS pour que les routes CRUD aient toujours des threads libres.
+ENDPOINT_LIMITS = {
+    'play': (4, 12),
+    'search': (2, 6),
+    'import': (1, 2)
+}
+ADMISSION_TIMEOUT = 30  # Attente maximale d'une place avant de répondre 429
+STATS_FLUSH_INTERVAL = 30  # Secondes entre deux écritures de stats.json
+SPOTIFY_RATE = 5  # Requêtes Spotify par seconde en régime établi
+SPOTIFY_BURST = 10  # Requêtes autorisées d'un coup avant de ralentir
+SPOTIFY_MAX_RETRIES = 5  # Tentatives après une réponse 429
+SPOTIFY_PAGE_SIZE = 100
+SPOTIFY_PAGE_WORKERS = 4  # Pages de morceaux récupérées en parallèle
+SPOTIFY_META_TTL = 300  # Métadonnées de playlist (nom, snapshot_id) réutilisées 5 minutes
+SPOTIFY_CACHE_SIZE = 50  # Listes de morceaux gardées par snapshot_id
+SPOTIFY_SYNC_INTERVAL = 3600  # Resynchronisation des playlists abonnées toutes les heures
+# Bornes (ms) des histogrammes de latence, du cache mémoire (0,1 ms) à la minute
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+PROFILE_INTERVAL = 0.001  # Secondes entre deux échantillons du profileur
+PROFILE_TOP = 20  # Fonctions retenues dans un profil
+MATCH_CANDIDATES = 5  # Résultats YouTube comparés à chaque morceau importé (une seule requête)
+MATCH_DURATION_TOLERANCE = 3  # Secondes d'écart sans pénalité
+MATCH_DURATION_RANGE = 30  # Au-delà de tolérance + 30 s, la durée ne compte plus
+# Versions rarement voulues, pénalisées si le titre Spotify ne les mentionne pas
+MATCH_PENALTIES = {
+    'live': 0.3, 'cover': 0.4, 'karaoke': 0.5, 'instrumental': 0.3, 'remix': 0.25,
+    'nightcore': 0.5, 'slowed': 0.4, 'sped': 0.4, 'reverb': 0.3, 'loop': 0.4,
+    'hour': 0.4, 'hours': 0.4, 'lesson': 0.4, 'tutorial': 0.4, 'boosted': 0.3, 'mashup': 0.3
+}
+# Mots sans valeur pour comparer un titre
+MATCH_STOPWORDS = {
+    'the', 'a', 'an', 'official', 'video', 'audio', 'music', 'lyrics', 'lyric', 'hd', '4k',
+    'feat', 'ft', 'with', 'remastered', 'remaster', 'topic', 'vevo'
+}
 
 # Configuration Spotify
 SPOTIFY_CLIENT_ID = ''
 SPOTIFY_CLIENT_SECRET = ''
 
 # Initialisation de l'API Spotify
-sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-    client_id=SPOTIFY_CLIENT_ID,
-    client_secret=SPOTIFY_CLIENT_SECRET
-))
+def spotify_session():
+    """Session HTTP de spotipy : les 429 remontent à SpotifyClient au lieu d'être retentés ici"""
+    import requests
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=3,
+        connect=None,
+        read=False,
+        status=3,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        respect_retry_after_header=False
+    )
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# yt-dlp et spotipy représentent l'essentiel du temps d'import : chargés au premier usage
+YoutubeDL = None
+_spotify_client = None
+_spotify_client_lock = threading.Lock()
+
+def load_youtube_dl():
+    """Classe YoutubeDL, importée au premier appel (remplaçable par les benchmarks)"""
+    global YoutubeDL
+    if YoutubeDL is None:
+        from yt_dlp import YoutubeDL as youtube_dl_class
+        YoutubeDL = youtube_dl_class
+    return YoutubeDL
+
+def get_spotify_client():
+    """Client spotipy, créé au premier appel"""
+    global _spotify_client
+    with _spotify_client_lock:
+        if _spotify_client is None:
+            import spotipy
+            from spotipy.oauth2 import SpotifyClientCredentials
+            _spotify_client = spotipy.Spotify(
+                auth_manager=SpotifyClientCredentials(
+                    client_id=SPOTIFY_CLIENT_ID,
+                    client_secret=SPOTIFY_CLIENT_SECRET
+                ),
+                requests_session=spotify_session()
+            )
+        return _spotify_client
+
+def is_spotify_error(error):
+    # Sans import préalable de spotipy, l'erreur ne peut pas venir de Spotify
+    spotipy = sys.modules.get('spotipy')
+    return spotipy is not None and isinstance(error, spotipy.SpotifyException)
+
+def __getattr__(name):
+    # `app.sp` reste accessible et n'est créé qu'à sa première lecture
+    if name == 'sp':
+        return get_spotify_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Configuration optimisée de yt-dlp
 ydl_opts = {
@@ -68,6 +248,24 @@ ydl_opts = {
     }]
 }
 
+# Options minimales par rôle : pas de post-traitement FFmpeg pour les appels de métadonnées
+_metadata_opts = {
+    key: value for key, value in ydl_opts.items()
+    if key not in ('format', 'postprocessors', 'prefer_ffmpeg', 'http_chunk_size')
+}
+search_opts = {**_metadata_opts, 'extract_flat': True}
+resolve_opts = {**_metadata_opts, 'format': ydl_opts['format'], 'extract_flat': False}
+
+# Téléchargement complet pour l'écoute hors-ligne (fichiers .part repris si interrompus)
+download_opts = {
+    **ydl_opts,
+    'extract_flat': False,
+    'skip_download': False,
+    'ignoreerrors': False,
+    'continuedl': True,
+    'outtmpl': os.path.join(PINNED_DIR, '%(id)s.%(ext)s')
+}
+
 # Configuration du logging
 logging.basicConfig(
     level=logging.INFO,
@@ -78,131 +276,2068 @@ logging.basicConfig(
     ]
 )
 
-# Cache initialization
-audio_cache = {}
-last_cache_cleanup = time.time()
+# Pool dédié à la résolution des morceaux importés (borné par IMPORT_WORKERS)
+import_executor = MeteredExecutor(max_workers=IMPORT_WORKERS)
+
+class ExtractorPool:
+    """Instances YoutubeDL préchauffées pour un rôle, prêtées à un thread à la fois"""
+
+    def __init__(self, role, opts, size=EXTRACTOR_POOL_SIZE, max_uses=EXTRACTOR_MAX_USES):
+        self.role = role
+        self.opts = opts
+        self.size = size
+        self.max_uses = max_uses
+        self._idle = []  # (instance, nombre d'utilisations)
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+
+    def _create(self):
+        with self._lock:
+            self.created += 1
+        return load_youtube_dl()(dict(self.opts))
+
+    def _close(self, ydl):
+        try:
+            ydl.close()
+        except Exception as e:
+            logging.error(f"Erreur fermeture extracteur {self.role}: {e}")
+
+    def prewarm(self):
+        instances = [self._create() for _ in range(self.size - len(self._idle))]
+        with self._lock:
+            self._idle.extend((ydl, 0) for ydl in instances)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ydl, _ in idle:
+            self._close(ydl)
+
+    @contextmanager
+    def extractor(self):
+        with self._lock:
+            entry = self._idle.pop() if self._idle else None
+            if entry:
+                self.reused += 1
+        ydl, uses = entry or (self._create(), 0)
+
+        try:
+            yield ydl
+        except Exception:
+            # Une instance ayant levé une erreur n'est pas réutilisée
+            with self._lock:
+                self.recycled += 1
+            self._close(ydl)
+            raise
+
+        uses += 1
+        with self._lock:
+            if uses < self.max_uses and len(self._idle) < self.size:
+                self._idle.append((ydl, uses))
+                return
+            if uses >= self.max_uses:
+                self.recycled += 1
+        self._close(ydl)
+
+    def metrics(self):
+        return {
+            'idle': len(self._idle),
+            'created': self.created,
+            'reused': self.reused,
+            'recycled': self.recycled
+        }
+
+extractors = {
+    'search': ExtractorPool('search', search_opts),
+    'resolve': ExtractorPool('resolve', resolve_opts),
+    'download': ExtractorPool('download', download_opts, size=PIN_WORKERS)
+}
+
+class LRUCache:
+    """Cache LRU thread-safe avec expiration par entrée et compteurs"""
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # clé -> (expiration, valeur)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None):
+        return self.get_first((key,), default)
+
+    def get_first(self, keys, default=None):
+        """Retourne la valeur de la première clé présente (un seul hit ou miss)"""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._lookup(key, now)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[1]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, expires_at=None):
+        if expires_at is None and self.ttl:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else default
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key, time.time()) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (exp, _) in self._data.items() if exp is not None and exp <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def dump(self):
+        """Liste (clé, expiration, valeur) du moins au plus récemment utilisé"""
+        with self._lock:
+            return [(k, exp, v) for k, (exp, v) in self._data.items()]
+
+    def load(self, entries):
+        now = time.time()
+        for key, expires_at, value in entries:
+            # Chargé en arrière-plan : une entrée déjà en mémoire est plus récente
+            if (expires_at is None or expires_at > now) and key not in self:
+                self.set(key, value, expires_at)
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+class SingleFlight:
+    """Regroupe les appels concurrents pour une même clé en une seule exécution"""
+
+    def __init__(self, negative_ttl=0, max_failures=1000):
+        self._calls = {}  # clé -> Future de l'exécution en cours
+        self._lock = threading.Lock()
+        self._failures = LRUCache(max_failures, negative_ttl) if negative_ttl else None
+        self.executions = 0
+        self.shared = 0
+
+    @staticmethod
+    def _fresh(error_type, args):
+        """Nouvelle exception à chaque appelant : l'originale n'est jamais relancée ni sa trace allongée"""
+        try:
+            return error_type(*args)
+        except Exception:
+            return Exception(*args)
+
+    def do(self, key, fn, *args):
+        if self._failures is not None:
+            failure = self._failures.get(key)
+            if failure is not None:
+                raise self._fresh(*failure)
+
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            error = future.exception()
+            if error is not None:
+                raise self._fresh(type(error), error.args) from error
+            return future.result()
+
+        try:
+            result = fn(*args)
+        except Exception as e:
+            if self._failures is not None:
+                self._failures.set(key, (type(e), e.args))
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self):
+        return len(self._calls)
+
+    def metrics(self):
+        return {
+            'executions': self.executions,
+            'shared': self.shared,
+            'in_flight': self.in_flight()
+        }
+
+class LatencyHistogram:
+    """Histogramme de durées (ms) à bornes fixes, percentiles estimés par interpolation"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Le dernier seau reçoit tout ce qui dépasse
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms):
+        i = bisect.bisect_left(self.buckets, elapsed_ms)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total_ms += elapsed_ms
+            if elapsed_ms > self.max_ms:
+                self.max_ms = elapsed_ms
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.total_ms, self.max_ms
+
+    def _percentile(self, counts, count, max_ms, q):
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else max_ms
+                return min(low + (high - low) * (rank - seen) / n, max_ms)
+            seen += n
+        return max_ms
+
+    def metrics(self):
+        counts, count, total_ms, max_ms = self.snapshot()
+        return {
+            'count': count,
+            'avg_ms': round(total_ms / count, 2) if count else 0.0,
+            'p50_ms': round(self._percentile(counts, count, max_ms, 0.50), 2),
+            'p95_ms': round(self._percentile(counts, count, max_ms, 0.95), 2),
+            'p99_ms': round(self._percentile(counts, count, max_ms, 0.99), 2),
+            'max_ms': round(max_ms, 2)
+        }
+
+# Histogrammes de latence des chemins critiques, créés au premier usage
+latencies = {}
+_latencies_lock = threading.Lock()
+
+def latency(name):
+    hist = latencies.get(name)
+    if hist is None:
+        with _latencies_lock:
+            hist = latencies.setdefault(name, LatencyHistogram())
+    return hist
+
+class timed:
+    """Mesure la durée du bloc (ou de chaque appel de la fonction décorée) dans l'histogramme `name`"""
+    __slots__ = ('hist', 'start')
+
+    def __init__(self, name):
+        self.hist = latency(name)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe((time.perf_counter() - self.start) * 1000)
+        return False
+
+    def __call__(self, fn):
+        hist = self.hist
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe((time.perf_counter() - start) * 1000)
+        return wrapper
+
+class RequestProfiler:
+    """Profileur par échantillonnage des piles, une seule requête profilée à la fois"""
+
+    def __init__(self, interval=PROFILE_INTERVAL, top=PROFILE_TOP):
+        self.interval = interval
+        self.top = top
+        self.last = None
+        self.profiled = 0
+        self.skipped = 0
+        self._busy = threading.Lock()
+
+    def start(self):
+        """Échantillonne le thread appelant, None si un profil est déjà en cours"""
+        if not self._busy.acquire(blocking=False):
+            self.skipped += 1
+            return None
+        profile = {
+            'thread': threading.get_ident(),
+            'samples': Counter(),
+            'stop': threading.Event(),
+            'start': time.perf_counter()
+        }
+        profile['sampler'] = threading.Thread(target=self._sample, args=(profile,), daemon=True)
+        profile['sampler'].start()
+        return profile
+
+    def _sample(self, profile):
+        while not profile['stop'].wait(self.interval):
+            frame = sys._current_frames().get(profile['thread'])
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            profile['samples'][tuple(stack)] += 1
+
+    def stop(self, profile, label):
+        profile['stop'].set()
+        profile['sampler'].join()
+        elapsed_ms = (time.perf_counter() - profile['start']) * 1000
+        total = sum(profile['samples'].values())
+        own, cumulative = Counter(), Counter()
+        for stack, n in profile['samples'].items():
+            # La pile va de la fonction en cours vers ses appelants
+            own[stack[0]] += n
+            for function in set(stack):
+                cumulative[function] += n
+
+        def ranking(counter):
+            return [
+                {'function': function, 'samples': n, 'share': round(n / total, 3)}
+                for function, n in counter.most_common(self.top)
+            ]
+
+        self.last = {
+            'request': label,
+            'duration_ms': round(elapsed_ms, 2),
+            'samples': total,
+            'self': ranking(own),
+            'cumulative': ranking(cumulative)
+        }
+        self.profiled += 1
+        self._busy.release()
+        hottest = own.most_common(1)
+        logging.info(
+            f"Profil {label}: {elapsed_ms:.1f} ms, {total} échantillons"
+            + (f", surtout dans {hottest[0][0]}" if hottest else '')
+        )
+        return self.last
+
+profiler = RequestProfiler()
+
+class JobRegistry:
+    """Registre borné des tâches de fond, observable par attente de version"""
+
+    def __init__(self, max_jobs=MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._cond = threading.Condition()
+
+    def create(self, **fields):
+        job_id = uuid.uuid4().hex
+        with self._cond:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': 'running',
+                'version': 0,
+                'created': time.time(),
+                **fields
+            }
+            self._evict()
+        return job_id
+
+    def _evict(self):
+        # On évince d'abord les tâches terminées les plus anciennes
+        excess = len(self._jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] != 'running']
+        for job_id in finished[:excess]:
+            del self._jobs[job_id]
+
+    def update(self, job_id, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job['version'] += 1
+            self._cond.notify_all()
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, version, timeout=None):
+        """Attend qu'une tâche dépasse la version donnée, retourne sa copie"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]['version'] > version,
+                timeout=timeout
+            )
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+# Imports Spotify et autres tâches de fond
+jobs = JobRegistry()
+
+class EndpointLimiter:
+    """Borne les requêtes simultanées d'un endpoint, avec une file d'attente limitée"""
+
+    def __init__(self, name, concurrency, queue_depth, timeout=ADMISSION_TIMEOUT):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.pending = 0  # Requêtes en cours + en attente
+        self.active = 0
+        self.peak = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @contextmanager
+    def admit(self):
+        """Réserve une place ou lève une erreur 429 si la file est pleine"""
+        with self._lock:
+            if self.pending >= self.concurrency + self.queue_depth:
+                self.rejected += 1
+                abort(429)
+            self.pending += 1
+        try:
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                abort(429)
+            with self._lock:
+                self.active += 1
+                self.admitted += 1
+                self.peak = max(self.peak, self.active)
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.active -= 1
+                self._slots.release()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'queue_depth': self.queue_depth,
+                'active': self.active,
+                'waiting': self.pending - self.active,
+                'peak': self.peak,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts
+            }
+
+# Limites des endpoints qui attendent yt-dlp ou Spotify
+limiters = {
+    name: EndpointLimiter(name, concurrency, queue_depth)
+    for name, (concurrency, queue_depth) in ENDPOINT_LIMITS.items()
+}
+
+def limited(name):
+    """Décorateur : la route entière passe par le limiteur `name`"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with limiters[name].admit():
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class PooledRequestHandler(WSGIRequestHandler):
+    # Une connexion keep-alive inactive ne doit pas monopoliser un thread du pool
+    timeout = SERVER_KEEPALIVE_TIMEOUT
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Serveur WSGI servant les connexions depuis un pool de threads borné"""
+    multithread = True
+
+    def __init__(self, host, port, wsgi_app, threads=SERVER_THREADS):
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+        super().__init__(host, port, wsgi_app, PooledRequestHandler)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+# Correspondances morceau Spotify -> vidéo YouTube, partagées entre imports
+match_cache = LRUCache(MATCH_CACHE_SIZE, MATCH_CACHE_TTL)
+_match_cache_save_lock = threading.Lock()
+
+# Cache des URLs audio, chaque entrée expire avec son URL googlevideo
+audio_cache = LRUCache(MAX_CACHE_SIZE, CACHE_TIMEOUT)
+# Une seule extraction yt-dlp à la fois par vidéo
+audio_flight = SingleFlight(negative_ttl=NEGATIVE_CACHE_TTL)
+
+def stream_url_expiry(url):
+    """Retourne l'échéance d'une URL googlevideo (paramètre expire=), ou None"""
+    try:
+        parsed = urlparse(url)
+        expire = parse_qs(parsed.query).get('expire', [None])[0]
+        if expire is None:
+            match = re.search(r'/expire/(\d+)', parsed.path)
+            expire = match.group(1) if match else None
+        if expire is None:
+            return None
+        return int(expire) - STREAM_URL_MARGIN
+    except (TypeError, ValueError):
+        return None
+
+def cleanup_cache():
+    """Supprime les URLs audio expirées"""
+    return audio_cache.purge_expired()
+
+@timed('audio_extraction')
+def extract_audio_url(video_id):
+    """Extrait l'URL audio d'une vidéo via yt-dlp et la met en cache"""
+    with extractors['resolve'].extractor() as ydl:
+        info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+        if not info:
+            raise Exception("Could not extract video info")
+
+        data = {
+            'url': info.get('url'),
+            'title': info.get('title', 'Unknown Title')
+        }
+        if data['url']:
+            audio_cache.set(video_id, data, expires_at=stream_url_expiry(data['url']))
+        return data
+
+@timed('audio_url')
+def get_audio_url(video_id):
+    cached = audio_cache.get(video_id)
+    if cached:
+        return cached
+
+    try:
+        return audio_flight.do(video_id, extract_audio_url, video_id)
+    except Exception as e:
+        logging.error(f"Error getting audio URL for {video_id}: {str(e)}")
+        return None
+
+class PrefetchScheduler:
+    """Résout en arrière-plan les prochains morceaux de la playlist en cours"""
+
+    def __init__(self, depth=PREFETCH_DEPTH, workers=PREFETCH_WORKERS):
+        self.depth = depth
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._futures = []
+        self.scheduled = 0
+        self.cancelled = 0
+        self.plays = 0
+        self.warm_plays = 0
+
+    def schedule(self, playlist_name, current_index):
+        """Planifie les `depth` morceaux suivants, en annulant les précédents"""
+        songs = playlists.get(playlist_name) or []
+        upcoming = [song['id'] for song in songs[current_index + 1:current_index + 1 + self.depth]]
+
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            for future in self._futures:
+                if future.cancel():
+                    self.cancelled += 1
+            # Soumis dans l'ordre : le morceau immédiatement suivant passe en premier
+            self._futures = [
+                self._pool.submit(self._prefetch, generation, video_id)
+                for video_id in upcoming
+                if video_id not in audio_cache and not offline.local_path(video_id)
+            ]
+            self.scheduled += len(self._futures)
+
+    def _prefetch(self, generation, video_id):
+        # L'utilisateur a changé de morceau ou de playlist entre-temps
+        if generation != self._generation:
+            return
+        get_audio_url(video_id)
+
+    def record_play(self, warm):
+        with self._lock:
+            self.plays += 1
+            if warm:
+                self.warm_plays += 1
+
+    def metrics(self):
+        return {
+            'depth': self.depth,
+            'scheduled': self.scheduled,
+            'cancelled': self.cancelled,
+            'plays': self.plays,
+            'warm_plays': self.warm_plays,
+            'warm_ratio': round(self.warm_plays / self.plays, 3) if self.plays else 0.0
+        }
+
+prefetcher = PrefetchScheduler()
+
+class UpstreamExpired(Exception):
+    """L'URL googlevideo a expiré (403/410)"""
+
+def fetch_upstream_range(url, start, end):
+    """Récupère les octets [start, end] d'une URL, retourne (données, taille totale, type)"""
+    req = urllib.request.Request(url, headers={
+        'Range': f'bytes={start}-{end}',
+        'User-Agent': 'Mozilla/5.0'
+    })
+    try:
+        with urllib.request.urlopen(req, timeout=ydl_opts['socket_timeout']) as resp:
+            data = resp.read()
+            content_range = resp.headers.get('Content-Range', '')
+            if resp.status == 200:
+                # Le serveur a ignoré le Range : on a reçu tout le fichier
+                total = len(data)
+            elif '/' in content_range and not content_range.endswith('*'):
+                total = int(content_range.rsplit('/', 1)[1])
+            else:
+                total = None
+            return data, total, resp.headers.get_content_type(), resp.status == 200
+    except urllib.error.HTTPError as e:
+        if e.code in (403, 410):
+            raise UpstreamExpired(f"HTTP {e.code}") from e
+        raise
+
+class SegmentFile:
+    """Fichier audio creux sur disque, rempli segment par segment"""
+
+    def __init__(self, video_id, directory):
+        self.video_id = video_id
+        self.path = os.path.join(directory, f"{video_id}.audio")
+        self.meta_path = f"{self.path}.json"
+        self.lock = threading.Lock()
+        self.size = None
+        self.mimetype = 'audio/mp4'
+        self.segments = set()
+        self.last_access = time.time()
+        try:
+            if os.path.exists(self.path) and os.path.exists(self.meta_path):
+                with open(self.meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                self.size = meta['size']
+                self.mimetype = meta.get('mimetype', self.mimetype)
+                self.segments = set(meta['segments'])
+                self.last_access = os.path.getmtime(self.meta_path)
+        except Exception as e:
+            logging.error(f"Métadonnées de flux illisibles pour {video_id}: {e}")
+            self.size = None
+            self.segments = set()
+
+    @property
+    def cached_bytes(self):
+        if self.size is None:
+            return 0
+        return min(len(self.segments) * STREAM_SEGMENT_SIZE, self.size)
+
+    @property
+    def segment_count(self):
+        return -(-self.size // STREAM_SEGMENT_SIZE) if self.size else 0
+
+    @property
+    def complete(self):
+        return self.size is not None and len(self.segments) >= self.segment_count
+
+    def has_range(self, start, end):
+        return self.size is not None and all(
+            n in self.segments
+            for n in range(start // STREAM_SEGMENT_SIZE, end // STREAM_SEGMENT_SIZE + 1)
+        )
+
+    def _save_meta(self):
+        tmp_file = f"{self.meta_path}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'size': self.size,
+                'mimetype': self.mimetype,
+                'segments': sorted(self.segments)
+            }, f)
+        os.replace(tmp_file, self.meta_path)
+
+    def ensure_segment(self, n):
+        """Télécharge le segment n s'il n'est pas déjà sur disque, retourne les octets ajoutés"""
+        with self.lock:
+            self.last_access = time.time()
+            if n in self.segments:
+                return 0
+
+            start = n * STREAM_SEGMENT_SIZE
+            end = start + STREAM_SEGMENT_SIZE - 1
+            if self.size is not None:
+                end = min(end, self.size - 1)
+
+            data, total, mimetype, whole = self._fetch(start, end)
+            if self.size is None:
+                self.size = total if total is not None else len(data)
+                self.mimetype = mimetype or self.mimetype
+                with open(self.path, 'wb') as f:
+                    f.truncate(self.size)
+
+            with open(self.path, 'r+b') as f:
+                if whole:
+                    f.write(data)
+                    added = set(range(self.segment_count)) - self.segments
+                else:
+                    f.seek(start)
+                    f.write(data)
+                    added = {n}
+            self.segments |= added
+            self._save_meta()
+            return sum(min(STREAM_SEGMENT_SIZE, self.size - k * STREAM_SEGMENT_SIZE) for k in added)
+
+    def _fetch(self, start, end):
+        for attempt in range(2):
+            info = get_audio_url(self.video_id)
+            if not info or not info.get('url'):
+                raise UpstreamExpired("URL audio introuvable")
+            try:
+                return fetch_upstream_range(info['url'], start, end)
+            except UpstreamExpired:
+                # URL expirée en cours de lecture : on en résout une nouvelle
+                audio_cache.pop(self.video_id)
+                if attempt:
+                    raise
+
+    def read(self, start, length):
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def remove(self):
+        for path in (self.path, self.meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class StreamCache:
+    """Cache disque des flux audio, évincé par taille totale (LRU)"""
+
+    def __init__(self, directory, max_size=STREAM_CACHE_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.disk_hits = 0
+        self.upstream_fetches = 0
+        self.evictions = 0
+        self._load()
+
+    def _load(self):
+        try:
+            metas = [f for f in os.listdir(self.directory) if f.endswith('.audio.json')]
+        except FileNotFoundError:
+            return
+        files = [SegmentFile(meta[:-len('.audio.json')], self.directory) for meta in metas]
+        for segment_file in sorted(files, key=lambda f: f.last_access):
+            self._files[segment_file.video_id] = segment_file
+            self.total_bytes += segment_file.cached_bytes
+
+    def get(self, video_id):
+        with self._lock:
+            segment_file = self._files.get(video_id)
+            if segment_file is None:
+                segment_file = SegmentFile(video_id, self.directory)
+                self._files[video_id] = segment_file
+                self.total_bytes += segment_file.cached_bytes
+            self._files.move_to_end(video_id)
+            return segment_file
+
+    def ensure_segment(self, segment_file, n):
+        added = segment_file.ensure_segment(n)
+        with self._lock:
+            if added:
+                self.upstream_fetches += 1
+                self.total_bytes += added
+                self._evict(keep=segment_file.video_id)
+            else:
+                self.disk_hits += 1
+
+    def record_disk_hit(self):
+        with self._lock:
+            self.disk_hits += 1
+
+    def _evict(self, keep=None):
+        for video_id in list(self._files):
+            if self.total_bytes <= self.max_size:
+                break
+            if video_id == keep:
+                continue
+            segment_file = self._files[video_id]
+            # Fichier en cours de téléchargement : on ne bloque pas le cache sur le réseau, il sera évincé plus tard
+            if not segment_file.lock.acquire(blocking=False):
+                continue
+            try:
+                del self._files[video_id]
+                self.total_bytes -= segment_file.cached_bytes
+                segment_file.remove()
+            finally:
+                segment_file.lock.release()
+            self.evictions += 1
+
+    def metrics(self):
+        return {
+            'files': len(self._files),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_size,
+            'disk_hits': self.disk_hits,
+            'upstream_fetches': self.upstream_fetches,
+            'evictions': self.evictions
+        }
+
+stream_cache = StreamCache(STREAM_DIR)
+
+class OfflineManager:
+    """Télécharge en arrière-plan les playlists marquées hors-ligne"""
+
+    def __init__(self, directory, workers=PIN_WORKERS, quota=PIN_QUOTA):
+        self.directory = directory
+        self.quota = quota
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self.pinned = set()
+        self._queued = set()
+        self._failed = set()
+        self._progress = {}  # video_id -> pourcentage du téléchargement en cours
+        self.quota_reached = False
+        self._used_bytes = None  # Calculé par scan_usage(), au démarrage en arrière-plan ou au premier besoin
+
+    def scan_usage(self):
+        """Taille du dossier, calculée une fois sous le verrou : aucun ajout ni retrait n'est perdu"""
+        with self._lock:
+            if self._used_bytes is None:
+                self._used_bytes = sum(
+                    os.path.getsize(os.path.join(self.directory, file)) for file in os.listdir(self.directory)
+                )
+        return self._used_bytes
+
+    @property
+    def used_bytes(self):
+        if self._used_bytes is None:
+            return self.scan_usage()
+        return self._used_bytes
+
+    def _add_usage(self, delta):
+        # Appelé sous self._lock ; avant le parcours initial, le fichier sera compté (ou non) par scan_usage()
+        if self._used_bytes is not None:
+            self._used_bytes += delta
+
+    def load(self):
+        try:
+            if os.path.exists(PINNED_FILE):
+                with open(PINNED_FILE, 'r', encoding='utf-8') as f:
+                    self.pinned |= set(json.load(f))
+        except Exception as e:
+            logging.error(f"Erreur chargement playlists hors-ligne: {e}")
+
+    def save(self):
+        try:
+            tmp_file = f"{PINNED_FILE}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(sorted(self.pinned), f)
+            os.replace(tmp_file, PINNED_FILE)
+        except Exception as e:
+            logging.error(f"Erreur sauvegarde playlists hors-ligne: {e}")
+
+    def local_path(self, video_id):
+        """Chemin du fichier audio téléchargé, ou None"""
+        for ext in ALLOWED_AUDIO_FORMATS:
+            path = os.path.join(self.directory, f"{video_id}.{ext}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _wanted(self, video_id):
+        return any(name in self.pinned for name in playlists.containing(video_id))
+
+    def pin(self, name):
+        with self._lock:
+            self.pinned.add(name)
+        self.save()
+        self.enqueue(name)
+
+    def unpin(self, name):
+        with self._lock:
+            self.pinned.discard(name)
+            kept = {song['id'] for other in self.pinned for song in playlists.get(other, [])}
+        self.save()
+        # Les fichiers encore utilisés par une autre playlist hors-ligne sont conservés
+        for song in playlists.get(name, []):
+            path = self.local_path(song['id'])
+            if path and song['id'] not in kept:
+                size = os.path.getsize(path)
+                os.remove(path)
+                with self._lock:
+                    self._add_usage(-size)
+                    self.quota_reached = False
+
+    def rename(self, old_name, new_name):
+        with self._lock:
+            if old_name not in self.pinned:
+                return
+            self.pinned.discard(old_name)
+            self.pinned.add(new_name)
+        self.save()
+
+    def enqueue(self, name):
+        """Met en file les morceaux de la playlist qui ne sont pas encore sur disque"""
+        for song in playlists.get(name, []):
+            video_id = song['id']
+            with self._lock:
+                if video_id in self._queued or self.local_path(video_id):
+                    continue
+                self._queued.add(video_id)
+                self._failed.discard(video_id)
+            self._pool.submit(self._download, video_id)
+
+    def resume(self):
+        for name in list(self.pinned):
+            self.enqueue(name)
+
+    def _download(self, video_id):
+        try:
+            if not self._wanted(video_id) or self.local_path(video_id):
+                return
+            if self.used_bytes >= self.quota:
+                self.quota_reached = True
+                return
+
+            with extractors['download'].extractor() as ydl:
+                ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
+
+            path = self.local_path(video_id)
+            if not path:
+                raise Exception("Fichier audio introuvable après téléchargement")
+            with self._lock:
+                self._add_usage(os.path.getsize(path))
+        except Exception as e:
+            logging.error(f"Erreur téléchargement hors-ligne {video_id}: {str(e)}")
+            with self._lock:
+                self._failed.add(video_id)
+        finally:
+            with self._lock:
+                self._queued.discard(video_id)
+                self._progress.pop(video_id, None)
+
+    def progress_hook(self, d):
+        """Hook yt-dlp partagé par les instances du pool de téléchargement"""
+        video_id = (d.get('info_dict') or {}).get('id')
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if video_id and d.get('status') == 'downloading' and total:
+            self._progress[video_id] = round(d.get('downloaded_bytes', 0) * 100 / total, 1)
+
+    def status(self, name):
+        songs = playlists.get(name, [])
+        ids = [song['id'] for song in songs]
+        used_bytes = self.used_bytes
+        with self._lock:
+            return {
+                'playlist': name,
+                'pinned': name in self.pinned,
+                'total': len(ids),
+                'downloaded': sum(1 for video_id in ids if self.local_path(video_id)),
+                'queued': sum(1 for video_id in ids if video_id in self._queued),
+                'failed': sum(1 for video_id in ids if video_id in self._failed),
+                'downloading': {video_id: pct for video_id, pct in self._progress.items() if video_id in ids},
+                'used_bytes': used_bytes,
+                'quota_bytes': self.quota,
+                'quota_reached': self.quota_reached
+            }
+
+offline = OfflineManager(PINNED_DIR)
+download_opts['progress_hooks'] = [offline.progress_hook]
+
+def parse_range_header(header, size):
+    """Convertit un en-tête Range (une seule plage) en bornes incluses, ou None s'il est invalide ou multiple"""
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Plage suffixe : les N derniers octets
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+class PlaylistStore:
+    """Stockage SQLite (WAL) des playlists, une ligne par morceau"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS playlists (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            position INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS playlist_songs (
+            entry_id INTEGER PRIMARY KEY,
+            playlist_id INTEGER NOT NULL REFERENCES playlists(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            song_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_playlist_songs_order ON playlist_songs(playlist_id, position);
+        CREATE INDEX IF NOT EXISTS idx_playlist_songs_song ON playlist_songs(playlist_id, song_id);
+        CREATE TABLE IF NOT EXISTS playlist_sources (
+            playlist_id INTEGER PRIMARY KEY REFERENCES playlists(id) ON DELETE CASCADE,
+            kind TEXT NOT NULL,
+            source_id TEXT NOT NULL,
+            snapshot_id TEXT,
+            subscribed INTEGER NOT NULL DEFAULT 0,
+            synced_at REAL
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _conn(self):
+        # Une connexion par thread, le mode WAL laisse les lectures concurrentes aux écritures
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(song, playlist_id, position):
+        extra = {k: v for k, v in song.items() if k not in ('id', 'title')}
+        return (playlist_id, position, song['id'], song['title'], json.dumps(extra) if extra else None)
+
+    def _playlist_id(self, conn, name):
+        row = conn.execute('SELECT id FROM playlists WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0]
+
+    def is_empty(self):
+        return self._conn().execute('SELECT 1 FROM playlists LIMIT 1').fetchone() is None
+
+    def load_all(self):
+        conn = self._conn()
+        result = {name: [] for (name,) in conn.execute('SELECT name FROM playlists ORDER BY position')}
+        rows = conn.execute("""
+            SELECT p.name, s.song_id, s.title, s.extra
+            FROM playlist_songs s JOIN playlists p ON p.id = s.playlist_id
+            ORDER BY s.playlist_id, s.position
+        """)
+        for name, song_id, title, extra in rows:
+            song = {'id': song_id, 'title': title}
+            if extra:
+                song.update(json.loads(extra))
+            result[name].append(song)
+        return result
+
+    def load_sources(self):
+        """Origine des playlists importées : {nom: {kind, id, snapshot_id, subscribed, synced_at}}"""
+        rows = self._conn().execute("""
+            SELECT p.name, s.kind, s.source_id, s.snapshot_id, s.subscribed, s.synced_at
+            FROM playlist_sources s JOIN playlists p ON p.id = s.playlist_id
+        """)
+        return {
+            name: {
+                'kind': kind,
+                'id': source_id,
+                'snapshot_id': snapshot_id,
+                'subscribed': bool(subscribed),
+                'synced_at': synced_at
+            }
+            for name, kind, source_id, snapshot_id, subscribed, synced_at in rows
+        }
+
+    @timed('playlist_write')
+    def set_source(self, name, source):
+        with self._conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO playlist_sources '
+                '(playlist_id, kind, source_id, snapshot_id, subscribed, synced_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (self._playlist_id(conn, name), source['kind'], source['id'], source.get('snapshot_id'),
+                 int(source.get('subscribed', False)), source.get('synced_at'))
+            )
+
+    def _insert(self, conn, name, songs):
+        cur = conn.execute(
+            'INSERT INTO playlists (name, position) '
+            'VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM playlists))',
+            (name,)
+        )
+        conn.executemany(
+            'INSERT INTO playlist_songs (playlist_id, position, song_id, title, extra) VALUES (?, ?, ?, ?, ?)',
+            [self._row(song, cur.lastrowid, i) for i, song in enumerate(songs)]
+        )
+
+    @timed('playlist_write')
+    def create(self, name, songs=()):
+        with self._conn() as conn:
+            self._insert(conn, name, songs)
+
+    @timed('playlist_write')
+    def delete(self, name):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM playlists WHERE name = ?', (name,))
+
+    @timed('playlist_write')
+    def rename(self, name, new_name):
+        # Comme avec le dictionnaire, la playlist renommée passe en dernière position
+        with self._conn() as conn:
+            conn.execute(
+                'UPDATE playlists SET name = ?, '
+                'position = (SELECT COALESCE(MAX(position), -1) + 1 FROM playlists) WHERE name = ?',
+                (new_name, name)
+            )
+
+    def _append(self, conn, playlist_id, songs):
+        start = conn.execute(
+            'SELECT COALESCE(MAX(position), -1) + 1 FROM playlist_songs WHERE playlist_id = ?',
+            (playlist_id,)
+        ).fetchone()[0]
+        conn.executemany(
+            'INSERT INTO playlist_songs (playlist_id, position, song_id, title, extra) VALUES (?, ?, ?, ?, ?)',
+            [self._row(song, playlist_id, start + i) for i, song in enumerate(songs)]
+        )
+
+    def _delete(self, conn, playlist_id, song_ids):
+        conn.executemany(
+            'DELETE FROM playlist_songs WHERE playlist_id = ? AND song_id = ?',
+            [(playlist_id, song_id) for song_id in song_ids]
+        )
+
+    @timed('playlist_write')
+    def add_songs(self, name, songs):
+        with self._conn() as conn:
+            self._append(conn, self._playlist_id(conn, name), songs)
+
+    @timed('playlist_write')
+    def remove_songs(self, name, song_ids):
+        with self._conn() as conn:
+            self._delete(conn, self._playlist_id(conn, name), song_ids)
+
+    @timed('playlist_write')
+    def apply_batch(self, name, added=(), removed=(), order=None):
+        """Retraits, ajouts puis nouvel ordre (ids) dans une seule transaction"""
+        with self._conn() as conn:
+            playlist_id = self._playlist_id(conn, name)
+            self._delete(conn, playlist_id, removed)
+            self._append(conn, playlist_id, added)
+            if order is not None:
+                conn.executemany(
+                    'UPDATE playlist_songs SET position = ? WHERE playlist_id = ? AND song_id = ?',
+                    [(i, playlist_id, song_id) for i, song_id in enumerate(order)]
+                )
+
+    @timed('playlist_write')
+    def replace_songs(self, name, songs):
+        """Réécrit l'ordre complet d'une playlist (mélange)"""
+        with self._conn() as conn:
+            playlist_id = self._playlist_id(conn, name)
+            conn.execute('DELETE FROM playlist_songs WHERE playlist_id = ?', (playlist_id,))
+            conn.executemany(
+                'INSERT INTO playlist_songs (playlist_id, position, song_id, title, extra) VALUES (?, ?, ?, ?, ?)',
+                [self._row(song, playlist_id, i) for i, song in enumerate(songs)]
+            )
+
+    def migrate_json(self, json_file):
+        """Importe une seule fois l'ancien playlists.json dans la base"""
+        if not os.path.exists(json_file) or not self.is_empty():
+            return
+        with open(json_file, 'r') as f:
+            legacy = json.load(f)
+        # Une seule transaction : après une interruption la base reste vide et la migration est reprise
+        with self._conn() as conn:
+            for name, songs in legacy.items():
+                self._insert(conn, name, songs)
+        os.replace(json_file, f"{json_file}.migrated")
+        logging.info(f"{len(legacy)} playlists migrées vers {self.path}")
+
+store = PlaylistStore(PLAYLIST_DB)
+
+_COMBINING_MARKS = re.compile(r'[\u0300-\u036f]')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+def fold_text(text):
+    """Minuscules sans accents ni ponctuation, pour comparer des titres"""
+    text = text or ''
+    if not text.isascii():
+        text = _COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text))
+    return ' '.join(_PUNCTUATION.sub(' ', text.casefold()).split())
+
+class TitleIndex:
+    """Index inversé des titres (sans accents ni ponctuation), recherche par mots et débuts de mots"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}  # mot -> ids des morceaux dont le titre le contient
+        self._vocabulary = []  # mots triés, pour trouver tous les mots d'un même préfixe
+        self._docs = {}  # id -> (titre, mots)
+        self._refs = {}  # id -> nombre de références (une par playlist contenant le morceau)
+
+    def __contains__(self, song_id):
+        return song_id in self._docs
+
+    def __len__(self):
+        return len(self._docs)
+
+    def metrics(self):
+        return {'songs': len(self._docs), 'words': len(self._vocabulary)}
+
+    def add_many(self, songs):
+        """Référence des morceaux ; un titre n'est indexé qu'à la première référence"""
+        with self._lock:
+            new_words = []
+            for song in songs:
+                song_id = song['id']
+                refs = self._refs.get(song_id, 0)
+                self._refs[song_id] = refs + 1
+                if refs:
+                    continue
+                words = tuple(dict.fromkeys(fold_text(song['title']).split()))
+                self._docs[song_id] = (song['title'], words)
+                for word in words:
+                    ids = self._postings.get(word)
+                    if ids is None:
+                        ids = self._postings[word] = set()
+                        new_words.append(word)
+                    ids.add(song_id)
+            if len(new_words) > 64:
+                # Chargement initial ou gros import : un tri complet coûte moins que les insertions
+                self._vocabulary = sorted(self._postings)
+            else:
+                for word in new_words:
+                    bisect.insort(self._vocabulary, word)
+
+    def discard_many(self, song_ids):
+        """Retire une référence ; le titre quitte l'index avec la dernière"""
+        with self._lock:
+            for song_id in song_ids:
+                refs = self._refs.get(song_id)
+                if refs is None:
+                    continue
+                if refs > 1:
+                    self._refs[song_id] = refs - 1
+                    continue
+                del self._refs[song_id]
+                _, words = self._docs.pop(song_id)
+                for word in words:
+                    ids = self._postings[word]
+                    ids.discard(song_id)
+                    if not ids:
+                        del self._postings[word]
+                        del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+
+    def _matching_words(self, term):
+        # Un terme trop court ne correspond qu'à un mot entier (« a » ne ramène pas tout l'index)
+        lo = bisect.bisect_left(self._vocabulary, term)
+        if len(term) >= SEARCH_MIN_PREFIX:
+            hi = bisect.bisect_left(self._vocabulary, term + '\uffff', lo)
+        else:
+            hi = lo + 1 if lo < len(self._vocabulary) and self._vocabulary[lo] == term else lo
+        return self._vocabulary[lo:hi]
+
+    def search(self, query, limit):
+        """Morceaux dont chaque terme de la requête commence un mot du titre, mots entiers d'abord"""
+        terms = list(dict.fromkeys(fold_text(query).split()))
+        if not terms:
+            return []
+        with self._lock:
+            matches = []
+            for term in terms:
+                words = self._matching_words(term)
+                if not words:
+                    return []
+                matches.append((sum(len(self._postings[word]) for word in words), term, words))
+            # Le terme le plus sélectif d'abord, les suivants ne font que filtrer
+            matches.sort(key=lambda match: match[0])
+            candidates = None
+            size, term, words = matches[0]
+            if len(matches) == 1 and size > SEARCH_INDEX_SCAN:
+                # Un seul terme très courant : les premiers morceaux suffisent, mot entier d'abord
+                exact = [self._postings[term]] if term in self._postings else []
+                candidates = dict.fromkeys(itertools.islice(
+                    itertools.chain.from_iterable(exact + [self._postings[word] for word in words]),
+                    SEARCH_INDEX_SCAN))
+                matches = []
+            for size, term, words in matches:
+                if len(words) == 1:
+                    ids = self._postings[words[0]]
+                    candidates = ids if candidates is None else candidates & ids
+                elif candidates is None or size < 2 * len(candidates):
+                    ids = set().union(*(self._postings[word] for word in words))
+                    candidates = ids if candidates is None else candidates & ids
+                else:
+                    candidates = {song_id for song_id in candidates if self._has_prefix(song_id, term)}
+                if not candidates:
+                    return []
+
+            exact = [self._postings[term] for term in terms if term in self._postings]
+
+            def rank(song_id):
+                return sum(song_id in ids for ids in exact), -len(self._docs[song_id][1])
+
+            if len(candidates) > SEARCH_INDEX_SCAN:
+                # Termes tous courants : seuls les premiers morceaux sont classés,
+                # en commençant par ceux qui contiennent tous les termes en mots entiers
+                whole = candidates.intersection(*exact) if len(exact) == len(terms) else ()
+                candidates = dict.fromkeys(itertools.islice(
+                    itertools.chain(whole, candidates), SEARCH_INDEX_SCAN))
+            best = heapq.nlargest(limit, candidates, key=rank)
+            return [{'id': song_id, 'title': self._docs[song_id][0]} for song_id in best]
+
+    def _has_prefix(self, song_id, term):
+        return any(word.startswith(term) for word in self._docs[song_id][1])
+
+class Playlist:
+    """Liste ordonnée de morceaux avec index id -> position, modifiée sous le verrou d'écriture de Library"""
+
+    def __init__(self, name, songs=()):
+        self.name = name
+        self.version = 0
+        self.source = None  # Playlist Spotify d'origine, pour la resynchronisation
+        self._songs = []
+        self._positions = {}
+        for song in songs:
+            if song['id'] not in self._positions:
+                self._positions[song['id']] = len(self._songs)
+                self._songs.append(song)
+
+    def __len__(self):
+        return len(self._songs)
+
+    def __contains__(self, song_id):
+        return song_id in self._positions
+
+    def __iter__(self):
+        return iter(self.songs())
+
+    def __getitem__(self, index):
+        return self._songs[index]
+
+    def songs(self):
+        return list(self._songs)
+
+    def ids(self):
+        return list(self._positions)
+
+    def position(self, song_id):
+        return self._positions.get(song_id)
+
+    def _reindex(self, start=0):
+        for i in range(start, len(self._songs)):
+            self._positions[self._songs[i]['id']] = i
+
+    def append(self, songs):
+        """Ajoute les morceaux absents, retourne ceux réellement ajoutés"""
+        added = []
+        for song in songs:
+            if song['id'] not in self._positions:
+                self._positions[song['id']] = len(self._songs)
+                self._songs.append(song)
+                added.append(song)
+        return added
+
+    def remove(self, song_ids):
+        """Retire les morceaux en une seule passe, retourne les ids retirés"""
+        removed = [song_id for song_id in dict.fromkeys(song_ids) if song_id in self._positions]
+        positions = {self._positions.pop(song_id) for song_id in removed}
+        if positions:
+            first = min(positions)
+            self._songs[first:] = [song for i, song in enumerate(self._songs[first:], first) if i not in positions]
+            self._reindex(first)
+        return removed
+
+    def replace(self, songs):
+        """Remplace tous les morceaux ; comme à la construction, seule la première occurrence d'un id est gardée"""
+        self._songs = []
+        self._positions = {}
+        self.append(songs)
+
+class Snapshot:
+    """État figé à une version ; chaque réponse JSON n'est sérialisée qu'une fois"""
+    __slots__ = ('version', '_rendered', '_render_lock')
+
+    def __init__(self, version):
+        self.version = version
+        self._rendered = {}
+        self._render_lock = threading.Lock()
+
+    def cached(self, key, make):
+        """Octets produits par make() pour cette version, calculés par un seul lecteur au premier appel"""
+        body = self._rendered.get(key)
+        if body is None:
+            with self._render_lock:
+                body = self._rendered.get(key)
+                if body is None:
+                    body = make()
+                    if len(self._rendered) < SNAPSHOT_RENDER_LIMIT:
+                        self._rendered[key] = body
+        return body
+
+    def render(self, key, build):
+        return self.cached(key, lambda: app.json.dumps(build()).encode())
+
+class PlaylistSnapshot(Snapshot):
+    """Playlist figée, lue sans verrou ; partagée entre les versions de la bibliothèque tant qu'elle ne change pas"""
+    __slots__ = ('name', 'source', '_songs')
+
+    def __init__(self, playlist):
+        super().__init__(playlist.version)
+        self.name = playlist.name
+        self.source = playlist.source
+        self._songs = tuple(playlist._songs)
+
+    def __len__(self):
+        return len(self._songs)
+
+    def __iter__(self):
+        return iter(self._songs)
+
+    def __getitem__(self, index):
+        return self._songs[index]
+
+    def songs(self):
+        return list(self._songs)
+
+class LibrarySnapshot(Snapshot):
+    """Bibliothèque figée : remplacée en bloc à chaque modification, jamais modifiée en place"""
+    __slots__ = ('playlists',)
+
+    def __init__(self, version, playlists):
+        super().__init__(version)
+        self.playlists = playlists  # nom -> PlaylistSnapshot
+
+    def to_dict(self):
+        return {name: playlist.songs() for name, playlist in self.playlists.items()}
+
+    def to_json(self):
+        """Corps de /playlists assemblé à partir du JSON de chaque playlist, réutilisé tant qu'elle ne change pas"""
+        parts = [
+            app.json.dumps(name).encode() + b': ' + playlist.render('songs', playlist.songs)
+            for name, playlist in sorted(self.playlists.items())
+        ]
+        return b'{"playlists": {' + b', '.join(parts) + b'}, "success": true}'
+
+    def summary(self):
+        return [
+            {'name': name, 'count': len(playlist), 'version': playlist.version}
+            for name, playlist in self.playlists.items()
+        ]
+
+class Library:
+    """Playlists en mémoire, persistées dans le store, avec index inverse, index des titres et journal des versions.
+
+    Un seul écrivain à la fois ; les lecteurs passent par l'instantané publié après chaque modification.
+    """
+
+    def __init__(self, store, data, sources=None):
+        self.store = store
+        self._lock = threading.RLock()  # Écrivain unique : toute modification passe par ce verrou
+        self._meta_lock = threading.Lock()  # Index inverse et journal, lus hors du verrou d'écriture
+        self._playlists = {}
+        self._containing = {}  # song_id -> noms des playlists qui le contiennent
+        self.titles = TitleIndex()  # Recherche locale, sans passer par YouTube (remplie par index_titles)
+        self._titles_ready = False
+        self._changes = deque(maxlen=PLAYLIST_CHANGELOG_SIZE)
+        self.version = 0
+        # Les versions repartent de zéro à chaque démarrage : l'époque distingue les ETags
+        self.epoch = uuid.uuid4().hex[:8]
+        for name, songs in data.items():
+            playlist = Playlist(name, songs)
+            if len(playlist) != len(songs):
+                # Doublons hérités de l'ancien format : on garde la première occurrence
+                store.replace_songs(name, playlist.songs())
+            playlist.source = (sources or {}).get(name)
+            self._playlists[name] = playlist
+            self._index(name, playlist.ids())
+        self._snapshot = LibrarySnapshot(0, {
+            name: PlaylistSnapshot(playlist) for name, playlist in self._playlists.items()
+        })
+
+    def _index(self, name, song_ids):
+        for song_id in song_ids:
+            self._containing.setdefault(song_id, set()).add(name)
+
+    def _unindex(self, name, song_ids):
+        for song_id in song_ids:
+            names = self._containing.get(song_id)
+            if names:
+                names.discard(name)
+                if not names:
+                    del self._containing[song_id]
+
+    def _commit(self, change, playlist=None, added=(), removed=(), renamed=None):
+        """Met à jour les index (playlists d'un morceau, titres) et enregistre la modification dans le journal"""
+        with self._meta_lock:
+            name = change['playlist']
+            if renamed:
+                self._unindex(name, renamed)
+                self._index(change['newName'], renamed)
+            self._unindex(name, removed)
+            self._index(name, [song['id'] for song in added])
+            if self._titles_ready:
+                self.titles.discard_many(removed)
+                self.titles.add_many(added)
+            self.version += 1
+            change['version'] = self.version
+            self._changes.append(change)
+            if playlist is not None:
+                playlist.version = self.version
+        self._publish(change['playlist'], change.get('newName'))
+
+    def _publish(self, *names):
+        """Publie un nouvel instantané ; seules les playlists `names` sont recopiées, les autres sont partagées"""
+        playlists = dict(self._snapshot.playlists)
+        for name in filter(None, names):
+            playlist = self._playlists.get(name)
+            if playlist is None:
+                playlists.pop(name, None)
+            else:
+                playlists[name] = PlaylistSnapshot(playlist)
+        # Une seule affectation : un lecteur voit l'ancien instantané ou le nouveau, jamais un état intermédiaire
+        self._snapshot = LibrarySnapshot(self.version, playlists)
+
+    def index_titles(self):
+        """Remplit l'index des titres, en arrière-plan au démarrage (l'essentiel du coût de chargement)"""
+        with self._lock:
+            if not self._titles_ready:
+                self.titles.add_many(song for playlist in self._playlists.values() for song in playlist.songs())
+                self._titles_ready = True
+
+    def snapshot(self):
+        """Instantané courant, cohérent et immuable"""
+        return self._snapshot
 
-def cleanup_cache():
-    """Nettoie le cache périodiquement"""
-    global last_cache_cleanup, audio_cache
-    current_time = time.time()
-    
-    if current_time - last_cache_cleanup > 300:  # Toutes les 5 minutes
-        audio_cache = {k: v for k, v in audio_cache.items() 
-                      if current_time - v.get('timestamp', 0) < CACHE_TIMEOUT}
-        while len(audio_cache) > MAX_CACHE_SIZE:
-            audio_cache.pop(next(iter(audio_cache)))
-        last_cache_cleanup = current_time
+    def __contains__(self, name):
+        return name in self._snapshot.playlists
 
-def get_audio_url(video_id):
-    cleanup_cache()
-    try:
-        if video_id in audio_cache:
-            cached = audio_cache[video_id]
-            if time.time() - cached['timestamp'] < CACHE_TIMEOUT:
-                return cached['data']
-        
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-            if not info:
-                raise Exception("Could not extract video info")
-                
-            data = {
-                'url': info.get('url'),
-                'title': info.get('title', 'Unknown Title')
-            }
-            audio_cache[video_id] = {
-                'data': data,
-                'timestamp': time.time()
-            }
-            return data
-    except Exception as e:
-        logging.error(f"Error getting audio URL for {video_id}: {str(e)}")
+    def __getitem__(self, name):
+        return self._snapshot.playlists[name]
+
+    def __iter__(self):
+        return iter(list(self._snapshot.playlists))
+
+    def __len__(self):
+        return len(self._snapshot.playlists)
+
+    def get(self, name, default=None):
+        return self._snapshot.playlists.get(name, default)
+
+    def to_dict(self):
+        return self._snapshot.to_dict()
+
+    def summary(self):
+        return self._snapshot.summary()
+
+    def changes_since(self, version):
+        """Modifications postérieures à `version`, ou None si le journal ne remonte plus assez loin"""
+        with self._meta_lock:
+            if version > self.version:
+                return None
+            if version == self.version:
+                return []
+            if not self._changes or self._changes[0]['version'] > version + 1:
+                return None
+            return [change for change in self._changes if change['version'] > version]
+
+    def find_source(self, kind, source_id):
+        """Nom de la playlist importée depuis cette source, s'il y en a une"""
+        for name, playlist in self._snapshot.playlists.items():
+            source = playlist.source
+            if source and source['kind'] == kind and source['id'] == source_id:
+                return name
         return None
 
-def preload_next_song(playlist_name, current_index):
-    if playlist_name not in playlists:
-        return
-    
-    playlist = playlists[playlist_name]
-    if current_index + 1 < len(playlist):
-        next_song_id = playlist[current_index + 1]['id']
-        if next_song_id not in audio_cache:
-            audio_info = get_audio_url(next_song_id)
-            if audio_info:
-                audio_cache[next_song_id] = audio_info
+    def subscribed(self):
+        return [
+            name for name, playlist in self._snapshot.playlists.items()
+            if playlist.source and playlist.source.get('subscribed')
+        ]
+
+    def set_source(self, name, **fields):
+        """Met à jour l'origine d'une playlist (identifiant, snapshot, abonnement)"""
+        with self._lock:
+            playlist = self._playlists[name]
+            source = {**(playlist.source or {}), **fields}
+            self.store.set_source(name, source)
+            playlist.source = source
+            self._publish(name)
+        return dict(source)
+
+    def containing(self, song_id):
+        """Noms des playlists contenant ce morceau"""
+        with self._meta_lock:
+            return sorted(self._containing.get(song_id, ()))
+
+    def create(self, name, songs=()):
+        with self._lock:
+            if name in self._playlists:
+                return False
+            playlist = Playlist(name, songs)
+            self.store.create(name, playlist.songs())
+            self._playlists[name] = playlist
+            change = {'op': 'create', 'playlist': name}
+            if len(playlist):
+                change['songs'] = playlist.songs()
+            self._commit(change, playlist, added=playlist.songs())
+            return True
+
+    def delete(self, name):
+        with self._lock:
+            playlist = self._playlists.pop(name, None)
+            if playlist is None:
+                return False
+            self.store.delete(name)
+            self._commit({'op': 'delete', 'playlist': name}, removed=playlist.ids())
+            return True
+
+    def rename(self, name, new_name):
+        with self._lock:
+            if name not in self._playlists or new_name in self._playlists:
+                return False
+            self.store.rename(name, new_name)
+            playlist = self._playlists.pop(name)
+            playlist.name = new_name
+            self._playlists[new_name] = playlist
+            self._commit(
+                {'op': 'rename', 'playlist': name, 'newName': new_name},
+                playlist,
+                renamed=playlist.ids()
+            )
+            return True
+
+    def add_songs(self, name, songs):
+        """Ajoute plusieurs morceaux d'un coup, retourne ceux réellement ajoutés"""
+        with self._lock:
+            playlist = self._playlists[name]
+            added = playlist.append(songs)
+            if added:
+                self.store.add_songs(name, added)
+                self._commit({'op': 'add', 'playlist': name, 'songs': added}, playlist, added=added)
+        return added
+
+    def remove_songs(self, name, song_ids):
+        with self._lock:
+            playlist = self._playlists[name]
+            removed = playlist.remove(song_ids)
+            if removed:
+                self.store.remove_songs(name, removed)
+                self._commit({'op': 'remove', 'playlist': name, 'ids': removed}, playlist, removed=removed)
+        return removed
+
+    def replace_songs(self, name, songs):
+        with self._lock:
+            playlist = self._playlists[name]
+            old_ids = playlist.ids()
+            kept = set(old_ids)
+            playlist.replace(songs)
+            self.store.replace_songs(name, playlist.songs())
+            # Seuls les morceaux entrés ou sortis changent les index (un mélange n'en change aucun)
+            self._commit(
+                {'op': 'replace', 'playlist': name, 'songs': playlist.songs()},
+                playlist,
+                added=[song for song in playlist.songs() if song['id'] not in kept],
+                removed=[song_id for song_id in old_ids if song_id not in playlist]
+            )
+        return playlist.songs()
+
+    def apply_batch(self, name, operations):
+        """Opérations add, remove et move appliquées toutes ou aucune, en une seule écriture"""
+        with self._lock:
+            playlist = self._playlists[name]
+            original = playlist.songs()
+            songs = list(original)
+            present = {song['id'] for song in songs}
+            for operation in operations:
+                kind = operation.get('op') if isinstance(operation, dict) else None
+                if kind == 'add':
+                    new = operation.get('songs', [operation.get('song')])
+                    if not isinstance(new, list) or not all(
+                            isinstance(song, dict) and 'id' in song and 'title' in song for song in new):
+                        raise ValueError('Morceaux invalides')
+                    fresh = []
+                    for song in new:
+                        if song['id'] not in present:
+                            present.add(song['id'])
+                            fresh.append(song)
+                    position = operation.get('position')
+                    if position is None:
+                        songs.extend(fresh)
+                    else:
+                        songs[int(position):int(position)] = fresh
+                elif kind == 'remove':
+                    ids = set(operation.get('ids', [operation.get('id')]))
+                    songs = [song for song in songs if song['id'] not in ids]
+                    present -= ids
+                elif kind == 'move':
+                    song_id, to = operation.get('id'), operation.get('to')
+                    if song_id not in present or not isinstance(to, int):
+                        raise ValueError(f"Déplacement invalide : {song_id}")
+                    index = next(i for i, song in enumerate(songs) if song['id'] == song_id)
+                    songs.insert(max(0, min(to, len(songs) - 1)), songs.pop(index))
+                else:
+                    raise ValueError(f"Opération inconnue : {kind}")
+
+            old_ids = [song['id'] for song in original]
+            known = {song['id']: song for song in original}
+            # Un morceau retiré puis rajouté avec d'autres données est réécrit (retrait puis ajout)
+            added = [song for song in songs if known.get(song['id']) != song]
+            replaced = {song['id'] for song in added if song['id'] in known}
+            removed = [song_id for song_id in old_ids if song_id not in present or song_id in replaced]
+            order = [song['id'] for song in songs]
+            # Sans déplacement, les anciens morceaux gardent leur ordre et les nouveaux suivent
+            kept = [song_id for song_id in old_ids if song_id in present and song_id not in replaced]
+            moved = order != kept + [song['id'] for song in added]
+            if not (added or removed or moved):
+                return [], [], False
+
+            self.store.apply_batch(name, added, removed, order if moved else None)
+            playlist.replace(songs)
+            change = {'op': 'batch', 'playlist': name, 'songs': added, 'ids': removed}
+            if moved:
+                change['order'] = order
+            self._commit(change, playlist, added=added, removed=removed)
+        return added, removed, moved
+
+    def update_songs(self, name, transform):
+        """Remplace les morceaux par transform(morceaux actuels) sous le verrou d'écriture"""
+        with self._lock:
+            playlist = self._playlists[name]
+            current = playlist.songs()
+            songs = transform(current)
+            if songs == current:
+                return None
+            return self.replace_songs(name, songs)
 
 def load_playlists():
-    if os.path.exists(PLAYLIST_FILE):
-        with open(PLAYLIST_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_playlists(playlists):
-    with open(PLAYLIST_FILE, 'w') as f:
-        json.dump(playlists, f, indent=2)
-
-def load_stats():
-    default_stats = {
-        'totalSongsPlayed': 0,
-        'totalHoursPlayed': 0.0,
-        'lastUpdated': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    
-    try:
-        if os.path.exists(STATS_FILE):
-            with open(STATS_FILE, 'r', encoding='utf-8') as f:
-                loaded_stats = json.load(f)
-                return {**default_stats, **loaded_stats}
-        else:
-            with open(STATS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(default_stats, f, indent=2)
-            return default_stats
-    except Exception as e:
-        logging.error(f"Error loading stats: {str(e)}")
-        return default_stats
+    store.migrate_json(PLAYLIST_FILE)
+    return Library(store, store.load_all(), store.load_sources())
 
-def save_stats(new_stats):
-    try:
-        if not isinstance(new_stats, dict):
-            raise ValueError("Invalid stats format")
-        
-        new_stats['lastUpdated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        if 'totalHoursPlayed' in new_stats:
-            new_stats['totalHoursPlayed'] = round(float(new_stats['totalHoursPlayed']), 2)
-        
-        with open(STATS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(new_stats, f, indent=2)
-        return True
-    except Exception as e:
-        logging.error(f"Error saving stats: {str(e)}")
-        return False
+class StatsAggregator:
+    """Statistiques d'écoute en mémoire, écrites sur disque par lots"""
+
+    def __init__(self, path, flush_interval=STATS_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._dirty = False
+        self._loaded = False  # Pas d'écriture avant lecture du fichier existant
+        self.total_plays = 0
+        self.total_seconds = 0.0
+        self.last_updated = None
+        self.tracks = {}  # id -> {'title', 'plays', 'seconds', 'last_played'}
+        self.days = {}  # 'AAAA-MM-JJ' -> {'plays', 'seconds'}
+        self.titles = TitleIndex()  # Morceaux déjà écoutés, pour la recherche locale
+        self.events = 0
+        self.flushes = 0
+
+    def load(self):
+        try:
+            if not os.path.exists(self.path):
+                self._loaded = True
+                return
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading stats: {str(e)}")
+            # Fichier illisible mis de côté : les écritures suivantes repartent d'un fichier sain
+            try:
+                os.replace(self.path, f"{self.path}.corrupt")
+            except OSError as e:
+                logging.error(f"Error backing up stats: {str(e)}")
+            with self._lock:
+                self._loaded = True
+            return
+        with self._lock:
+            self._loaded = True
+            # Chargé en arrière-plan : les écoutes déjà reçues s'ajoutent au fichier.
+            # L'ancien format ne contient que les deux totaux.
+            self.total_plays += int(data.get('totalSongsPlayed', 0))
+            self.total_seconds += float(data.get('totalSeconds', data.get('totalHoursPlayed', 0.0) * 3600))
+            self.last_updated = self.last_updated or data.get('lastUpdated')
+            for rollups, loaded in ((self.tracks, data.get('tracks', {})), (self.days, data.get('days', {}))):
+                for key, totals in loaded.items():
+                    current = rollups.get(key)
+                    if current is None:
+                        rollups[key] = totals
+                    else:
+                        current['plays'] += totals['plays']
+                        current['seconds'] += totals['seconds']
+                        for field, value in totals.items():
+                            current.setdefault(field, value)
+            self.titles.add_many(
+                {'id': song_id, 'title': track['title']}
+                for song_id, track in self.tracks.items()
+                if track.get('title') and song_id not in self.titles
+            )
+
+    def record(self, song_id, seconds, playlist=None, title=None, new_play=False):
+        """Ajoute un évènement d'écoute aux cumuls, sans écriture disque"""
+        seconds = max(float(seconds or 0), 0.0)
+        now = datetime.now()
+        day = now.strftime("%Y-%m-%d")
+        with self._lock:
+            track = self.tracks.setdefault(song_id, {'title': title, 'plays': 0, 'seconds': 0.0})
+            totals = self.days.setdefault(day, {'plays': 0, 'seconds': 0.0})
+            if title:
+                track['title'] = title
+                if song_id not in self.titles:
+                    self.titles.add_many([{'id': song_id, 'title': title}])
+            if playlist:
+                track['playlist'] = playlist
+            if new_play:
+                self.total_plays += 1
+                track['plays'] += 1
+                totals['plays'] += 1
+            self.total_seconds += seconds
+            track['seconds'] += seconds
+            totals['seconds'] += seconds
+            track['last_played'] = now.strftime("%Y-%m-%d %H:%M:%S")
+            self.last_updated = track['last_played']
+            self.events += 1
+            self._dirty = True
+
+    def set_totals(self, total_plays=None, total_hours=None):
+        """Compatibilité avec les clients qui envoient directement leurs totaux"""
+        with self._lock:
+            if total_plays is not None:
+                self.total_plays = int(total_plays)
+            if total_hours is not None:
+                self.total_seconds = float(total_hours) * 3600
+            self.last_updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._dirty = True
+
+    def totals(self):
+        today = datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            return {
+                'totalSongsPlayed': self.total_plays,
+                'totalHoursPlayed': round(self.total_seconds / 3600, 2),
+                'todayHoursPlayed': round(self.days.get(today, {}).get('seconds', 0.0) / 3600, 2),
+                'lastUpdated': self.last_updated
+            }
+
+    def top_tracks(self, limit=10, by='plays'):
+        with self._lock:
+            best = heapq.nlargest(limit, self.tracks.items(), key=lambda item: item[1][by])
+            return [
+                {'id': song_id, **track, 'seconds': round(track['seconds'], 1)}
+                for song_id, track in best
+            ]
+
+    def hours_per_day(self, days=30):
+        with self._lock:
+            recent = sorted(self.days.items())[-days:]
+            return [
+                {'day': day, 'plays': totals['plays'], 'hours': round(totals['seconds'] / 3600, 2)}
+                for day, totals in recent
+            ]
+
+    def flush(self):
+        """Écrit les cumuls s'ils ont changé (fichier temporaire puis remplacement atomique)"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty or not self._loaded:
+                    return False
+                data = json.dumps({
+                    'totalSongsPlayed': self.total_plays,
+                    'totalHoursPlayed': round(self.total_seconds / 3600, 2),
+                    'totalSeconds': round(self.total_seconds, 1),
+                    'lastUpdated': self.last_updated,
+                    'tracks': self.tracks,
+                    'days': self.days
+                }, indent=2)
+                self._dirty = False
+            try:
+                with timed('stats_flush'):
+                    tmp_path = f"{self.path}.tmp"
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(data)
+                    os.replace(tmp_path, self.path)
+                self.flushes += 1
+                return True
+            except Exception as e:
+                logging.error(f"Error saving stats: {str(e)}")
+                with self._lock:
+                    self._dirty = True
+                return False
+
+    def start(self):
+        """Écriture périodique en arrière-plan"""
+        def run():
+            while not self._stop.wait(self.flush_interval):
+                self.flush()
+        threading.Thread(target=run, name='stats-flush', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'events': self.events,
+                'flushes': self.flushes,
+                'tracks': len(self.tracks),
+                'dirty': self._dirty
+            }
 
 playlists = load_playlists()
-stats = load_stats()
+# Statistiques d'écoute, écrites sur disque toutes les STATS_FLUSH_INTERVAL secondes
+stats = StatsAggregator(STATS_FILE)
 
 @app.route('/')
 def index():
     return send_from_directory(os.path.dirname(os.path.abspath(__file__)), 'index.html')
 
+# Résultats de recherche par requête normalisée, une seule recherche en vol par requête
+search_cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+search_flight = SingleFlight()
+
+def run_search(query):
+    """Recherche YouTube de SEARCH_RESULTS résultats, mise en cache"""
+    with extractors['search'].extractor() as ydl:
+        result = ydl.extract_info(f"ytsearch{SEARCH_RESULTS}:{query}", download=False)
+    # ignoreerrors : un échec YouTube renvoie None, à ne pas mettre en cache comme « aucun résultat »
+    if result is None:
+        raise Exception("Could not extract search results")
+    songs = [
+        {'title': entry['title'], 'id': entry['id']}
+        for entry in result.get('entries') or []
+        if entry
+    ]
+    search_cache.set(normalize_query(query), songs)
+    return songs
+
+@timed('local_search')
+def local_search(query, limit=SEARCH_LOCAL_RESULTS):
+    """Morceaux des playlists puis de l'historique dont le titre correspond, sans appel réseau"""
+    songs = playlists.titles.search(query, limit)
+    if len(songs) < limit:
+        found = {song['id'] for song in songs}
+        songs += [song for song in stats.titles.search(query, limit) if song['id'] not in found][:limit - len(songs)]
+    return [{**song, 'playlists': playlists.containing(song['id']), 'local': True} for song in songs]
+
 @app.route('/search', methods=['POST'])
 def search():
-    query = request.json.get('query')
-    with YoutubeDL(ydl_opts) as ydl:
-        try:
-            result = ydl.extract_info(f"ytsearch5:{query}", download=False)
-            songs = []
-            for entry in result['entries']:
-                if entry:
-                    songs.append({
-                        'title': entry['title'],
-                        'id': entry['id']
-                    })
-            return jsonify({'success': True, 'songs': songs})
-        except Exception as e:
-            print(f"Search error: {str(e)}")
-            return jsonify({'success': False, 'error': 'Search failed'})
+    data = request.json or {}
+    query = data.get('query') or ''
+    key = normalize_query(query)
+    if not key:
+        return api_response({'success': False, 'error': 'Recherche vide'})
+    try:
+        offset = max(int(data.get('offset', 0)), 0)
+        limit = max(min(int(data.get('limit', SEARCH_PAGE_SIZE)), SEARCH_RESULTS), 1)
+    except (TypeError, ValueError):
+        return api_response({'success': False, 'error': 'offset et limit doivent être des entiers'}), 400
+
+    # Morceaux déjà connus en tête de la première page, puis écartés des résultats YouTube
+    local = local_search(query)
+    if data.get('source') == 'local':
+        return api_response({'success': True, 'songs': local, 'total': len(local), 'next_offset': None})
+
+    with timed('search'):
+        songs = search_cache.get(key)
+        if songs is None:
+            # Seules les recherches réellement envoyées à YouTube passent par le limiteur
+            with limiters['search'].admit():
+                try:
+                    songs = search_flight.do(key, run_search, query)
+                except Exception as e:
+                    logging.error(f"Search error: {str(e)}")
+                    return api_response({'success': False, 'error': 'Search failed'})
+
+    # Écartés avant le découpage : chaque page garde `limit` résultats YouTube et `total` est parcourable
+    local_ids = {song['id'] for song in local}
+    remote = [song for song in songs if song['id'] not in local_ids]
+    page = [
+        {**song, 'playlists': playlists.containing(song['id'])}
+        for song in remote[offset:offset + limit]
+    ]
+    next_offset = offset + limit
+    return api_response({
+        'success': True,
+        'songs': (local if offset == 0 else []) + page,
+        'total': len(remote),
+        'next_offset': next_offset if next_offset < len(remote) else None
+    })
+
+@app.route('/search/suggest', methods=['GET'])
+def search_suggest():
+    """Suggestions pendant la saisie, uniquement depuis l'index local"""
+    query = request.args.get('q', '')
+    limit = max(min(request.args.get('limit', SEARCH_SUGGEST_LIMIT, type=int), SEARCH_SUGGEST_LIMIT), 1)
+    return api_response({'success': True, 'songs': local_search(query, limit)})
 
 # Configuration du logging
 logging.basicConfig(
@@ -218,22 +2353,47 @@ def is_valid_response(response):
         and response.get('success') is not None
     )
 
+def api_response(payload, status=None):
+    """Construit une réponse JSON dont l'enveloppe {'success': ...} est garantie"""
+    if not isinstance(payload, dict) or not isinstance(payload.get('success'), bool):
+        raise ValueError(f"Réponse sans enveloppe 'success': {type(payload).__name__}")
+    response = jsonify(payload)
+    response.enveloped = True
+    if status is not None:
+        response.status_code = status
+    return response
+
+@app.before_request
+def start_profile():
+    if app.config['PROFILING'] and request.args.get('profile') == '1':
+        g.profile = profiler.start()
+
+@app.after_request
+def stop_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.stop(profile, f"{request.method} {request.path}")
+        response.headers['X-Profile'] = '/metrics/profile'
+    return response
+
 @app.after_request
 def after_request(response):
     try:
         if response.status_code == 500:
             logging.error(f"Server error: {response.get_data(as_text=True)}")
-            return jsonify({
+            return api_response({
                 'success': False,
                 'error': 'Une erreur est survenue, veuillez réessayer'
-            }), 500
+            }, 500)
         
-        # Vérifier que la réponse est bien formatée
-        if response.mimetype == 'application/json':
+        # Les réponses construites par api_response ont déjà une enveloppe valide :
+        # on ne relit le JSON que pour les autres, ou pour toutes en mode strict
+        if response.mimetype == 'application/json' and (
+                app.config['STRICT_RESPONSES'] or not getattr(response, 'enveloped', False)):
             data = response.get_json()
             if not is_valid_response(data):
                 logging.warning(f"Invalid response format: {data}")
-                return jsonify({
+                return api_response({
                     'success': False,
                     'error': 'Format de réponse invalide'
                 })
@@ -250,19 +2410,19 @@ def handle_error(error):
     # Handle common HTTP errors
     if hasattr(error, 'code'):
         if error.code == 404:
-            return jsonify({
+            return api_response({
                 'success': False,
                 'error': 'Resource not found'
             }), 404
         elif error.code == 400:
-            return jsonify({
+            return api_response({
                 'success': False,
                 'error': 'Bad request'
             }), 400
     
     # Handle Spotify API errors
-    if isinstance(error, spotipy.SpotifyException):
-        return jsonify({
+    if is_spotify_error(error):
+        return api_response({
             'success': False,
             'error': 'Spotify API error',
             'details': error_msg
@@ -270,7 +2430,7 @@ def handle_error(error):
         
     # Handle download errors
     if 'DownloadError' in error_type:
-        return jsonify({
+        return api_response({
             'success': False,
             'error': 'Download error',
             'details': error_msg
@@ -278,7 +2438,7 @@ def handle_error(error):
         
     # Handle specific error cases
     if 'NotFound' in error_type:
-        return jsonify({
+        return api_response({
             'success': False,
             'error': 'Resource not found'
         }), 404
@@ -287,7 +2447,7 @@ def handle_error(error):
     logging.error(f"Unexpected error {error_type}: {error_msg}")
     
     # Return a generic error for unexpected cases
-    return jsonify({
+    return api_response({
         'success': False,
         'error': 'An error occurred while processing your request',
         'type': error_type
@@ -297,42 +2457,209 @@ def handle_error(error):
 def play(video_id):
     try:
         if not video_id:
-            return jsonify({'success': False, 'error': 'ID de vidéo manquant'}), 400
+            return api_response({'success': False, 'error': 'ID de vidéo manquant'}), 400
 
-        start_time = time.time()
-        info = get_audio_url(video_id)
-        
-        if time.time() - start_time > 10:
-            logging.warning(f"Réponse lente pour la vidéo {video_id}")
+        # Morceau disponible hors-ligne : lecture directe depuis le disque
+        if offline.local_path(video_id):
+            prefetcher.record_play(True)
+            return api_response({
+                'success': True,
+                'audio_url': f'/local/{video_id}',
+                'stream_url': f'/local/{video_id}',
+                'local': True
+            })
+
+        cached = video_id in audio_cache
+        prefetcher.record_play(cached)
+        # Une URL en cache est servie sans attendre derrière les extractions en cours
+        with nullcontext() if cached else limiters['play'].admit():
+            info = get_audio_url(video_id)
+
+        # Contexte de lecture : on prépare les morceaux suivants de la playlist
+        playlist_name = request.args.get('playlist')
+        index = request.args.get('index', type=int)
+        if playlist_name and index is not None:
+            prefetcher.schedule(playlist_name, index)
         
         if not info:
-            return jsonify({
+            return api_response({
                 'success': False,
                 'error': 'Impossible d\'obtenir l\'URL audio'
             }), 404
             
         if not info.get('url'):
-            return jsonify({
+            return api_response({
                 'success': False,
                 'error': 'URL audio non trouvée'
             }), 404
 
-        return jsonify({
+        return api_response({
             'success': True,
             'audio_url': info['url'],
+            'stream_url': f'/stream/{video_id}',
             'title': info['title']
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Erreur de lecture pour {video_id}: {str(e)}")
         error_type = type(e).__name__
-        return jsonify({
+        return api_response({
             'success': False,
             'error': 'Erreur lors de la lecture',
             'type': error_type,
             'details': str(e)
         }), 500
 
+@app.route('/local/<video_id>', methods=['GET'])
+def local_audio(video_id):
+    path = offline.local_path(video_id)
+    if not path:
+        return api_response({'success': False, 'error': 'Morceau non disponible hors-ligne'}), 404
+    return send_file(path, conditional=True)
+
+@app.route('/playlist/<name>/offline', methods=['GET', 'POST', 'DELETE'])
+def playlist_offline(name):
+    if name not in playlists:
+        return api_response({'success': False, 'error': 'Playlist non trouvée'})
+
+    if request.method == 'POST':
+        offline.pin(name)
+    elif request.method == 'DELETE':
+        offline.unpin(name)
+    return api_response({'success': True, 'offline': offline.status(name)})
+
+@app.route('/offline', methods=['GET'])
+def offline_status():
+    return api_response({
+        'success': True,
+        'playlists': [offline.status(name) for name in sorted(offline.pinned)]
+    })
+
+@app.route('/stream/<video_id>', methods=['GET'])
+def stream_audio(video_id):
+    """Sert le flux audio par plages HTTP depuis le cache disque"""
+    segment_file = stream_cache.get(video_id)
+    try:
+        if segment_file.size is None:
+            stream_cache.ensure_segment(segment_file, 0)
+    except Exception as e:
+        logging.error(f"Erreur de flux pour {video_id}: {str(e)}")
+        return api_response({'success': False, 'error': 'Flux audio indisponible'}), 502
+
+    size = segment_file.size
+    range_header = request.headers.get('Range')
+    byte_range = parse_range_header(range_header, size) if range_header else None
+    if byte_range is None:
+        # Plages multiples ou invalides ignorées (RFC 7233) : fichier entier
+        range_header = None
+        start, end = 0, size - 1
+    elif byte_range[0] >= size:
+        return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+    else:
+        start, end = byte_range
+
+    if segment_file.has_range(start, end):
+        # Plage entièrement sur disque : envoi direct du fichier (sendfile si le serveur le permet).
+        # Werkzeug relit l'en-tête Range : seulement si on l'a accepté, sinon il répondrait 416
+        stream_cache.record_disk_hit()
+        return send_file(segment_file.path, mimetype=segment_file.mimetype, conditional=range_header is not None)
+
+    def generate():
+        pos = start
+        while pos <= end:
+            n = pos // STREAM_SEGMENT_SIZE
+            stream_cache.ensure_segment(segment_file, n)
+            segment_end = min((n + 1) * STREAM_SEGMENT_SIZE - 1, end)
+            yield segment_file.read(pos, segment_end - pos + 1)
+            pos = segment_end + 1
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Length': str(end - start + 1)
+    }
+    if range_header:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return Response(
+        generate(),
+        status=206 if range_header else 200,
+        mimetype=segment_file.mimetype,
+        headers=headers,
+        direct_passthrough=True
+    )
+
+def collect_metrics():
+    return {
+        'audio_cache': audio_cache.metrics(),
+        'audio_extractions': audio_flight.metrics(),
+        'prefetch': prefetcher.metrics(),
+        'stream_cache': stream_cache.metrics(),
+        'match_cache': match_cache.metrics(),
+        'extractors': {role: pool.metrics() for role, pool in extractors.items()},
+        'executors': {'main': executor.metrics(), 'import': import_executor.metrics()},
+        'limits': {name: limiter.metrics() for name, limiter in limiters.items()},
+        'stats': stats.metrics(),
+        'spotify': spotify.metrics(),
+        'search': {
+            'cache': search_cache.metrics(),
+            'flight': search_flight.metrics(),
+            'index': {'library': playlists.titles.metrics(), 'history': stats.titles.metrics()},
+            'latency': latency('search').metrics()
+        },
+        'latency': {name: hist.metrics() for name, hist in sorted(latencies.items())}
+    }
+
+def prometheus_metrics(metrics):
+    """Format texte de Prometheus : histogrammes complets, compteurs et jauges aplatis"""
+    lines = [
+        '# HELP openpy_latency_seconds Durée des opérations critiques',
+        '# TYPE openpy_latency_seconds histogram'
+    ]
+    for name, hist in sorted(latencies.items()):
+        counts, count, total_ms, _ = hist.snapshot()
+        cumulative = 0
+        for bound, n in zip(hist.buckets + (float('inf'),), counts):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else f'{bound / 1000:g}'
+            lines.append(f'openpy_latency_seconds_bucket{{op="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'openpy_latency_seconds_sum{{op="{name}"}} {total_ms / 1000:.6f}')
+        lines.append(f'openpy_latency_seconds_count{{op="{name}"}} {count}')
+
+    def flatten(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key != 'latency':  # Déjà exporté en histogramme
+                    flatten(f'{prefix}_{key}', item)
+        elif isinstance(value, (bool, int, float)):
+            lines.append(f'{re.sub(r"[^a-zA-Z0-9_]", "_", prefix)} {float(value):g}')
+
+    flatten('openpy', metrics)
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    metrics = collect_metrics()
+    # JSON pour l'interface, texte pour un collecteur Prometheus (?format=prometheus ou Accept)
+    wants_text = request.args.get('format') == 'prometheus' or (
+        'format' not in request.args
+        and (request.accept_mimetypes.best_match(
+            ['application/json', 'text/plain; version=0.0.4', 'text/plain']) or '').startswith('text/plain')
+    )
+    if wants_text:
+        return Response(prometheus_metrics(metrics), content_type='text/plain; version=0.0.4; charset=utf-8')
+    return api_response({'success': True, 'metrics': metrics})
+
+@app.route('/metrics/profile', methods=['GET'])
+def get_last_profile():
+    return api_response({
+        'success': True,
+        'enabled': app.config['PROFILING'],
+        'profiled': profiler.profiled,
+        'skipped': profiler.skipped,
+        'profile': profiler.last
+    })
+
 @app.route('/save-theme', methods=['POST'])
 def save_theme():
     theme_data = request.json
@@ -343,17 +2670,17 @@ def save_theme():
                     'theme': theme_data.get('theme', 'default'),
                     'primaryColor': theme_data.get('primaryColor', '#fca606')
                 }, f, indent=2)
-            return jsonify({'success': True})
+            return api_response({'success': True})
         except Exception as e:
-            return jsonify({'success': False, 'error': str(e)})
-    return jsonify({'success': False, 'error': 'Invalid theme data'})
+            return api_response({'success': False, 'error': str(e)})
+    return api_response({'success': False, 'error': 'Invalid theme data'})
 
 @app.route('/get-theme', methods=['GET'])
 def get_theme():
     try:
         with open(THEME_FILE, 'r', encoding='utf-8') as f:
             theme_data = json.load(f)
-        return jsonify({'success': True, 'theme': theme_data})
+        return api_response({'success': True, 'theme': theme_data})
     except:
         default_theme = {
             'theme': 'default',
@@ -361,174 +2688,870 @@ def get_theme():
         }
         with open(THEME_FILE, 'w', encoding='utf-8') as f:
             json.dump(default_theme, f, indent=2)
-        return jsonify({'success': True, 'theme': default_theme})
+        return api_response({'success': True, 'theme': default_theme})
+
+def normalize_query(query):
+    """Normalise une requête de recherche (casse, accents, ponctuation)"""
+    query = unicodedata.normalize('NFKC', query).casefold()
+    return ' '.join(re.sub(r'[^\w\s]', ' ', query).split())
+
+def match_cache_keys(track, search_query):
+    keys = [f"q:{normalize_query(search_query)}"]
+    if track.get('id'):
+        keys.insert(0, f"spotify:{track['id']}")
+    return keys
+
+def load_match_cache():
+    """Charge le cache de correspondances depuis le disque"""
+    try:
+        if os.path.exists(MATCH_CACHE_FILE):
+            with open(MATCH_CACHE_FILE, 'r', encoding='utf-8') as f:
+                match_cache.load(json.load(f))
+    except Exception as e:
+        logging.error(f"Erreur chargement cache de correspondances: {e}")
+
+def save_match_cache():
+    """Écrit le cache de correspondances de façon atomique"""
+    with _match_cache_save_lock:
+        try:
+            tmp_file = f"{MATCH_CACHE_FILE}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(match_cache.dump(), f)
+            os.replace(tmp_file, MATCH_CACHE_FILE)
+        except Exception as e:
+            logging.error(f"Erreur sauvegarde cache de correspondances: {e}")
+
+
+class TokenBucket:
+    """Limiteur de débit : `rate` jetons par seconde, au plus `capacity` d'avance"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    delay = (1 - self._tokens) / self.rate
+                self.waited += delay
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Bloque tous les appels pendant `seconds` (Retry-After)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+class SpotifyClient:
+    """Accès Spotify : champs filtrés, pages en parallèle, débit limité, cache par snapshot"""
+
+    PLAYLIST_FIELDS = 'id,name,snapshot_id,tracks.total'
+    TRACK_FIELDS = 'total,items(track(id,name,duration_ms,artists(name)))'
+
+    def __init__(self, client=None, rate=SPOTIFY_RATE, burst=SPOTIFY_BURST,
+                 page_workers=SPOTIFY_PAGE_WORKERS, max_retries=SPOTIFY_MAX_RETRIES):
+        self._client = client
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self._pages = ThreadPoolExecutor(max_workers=page_workers, thread_name_prefix='spotify')
+        self.playlists = LRUCache(SPOTIFY_CACHE_SIZE, SPOTIFY_META_TTL)
+        self.snapshots = LRUCache(SPOTIFY_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_spotify_client()
+        return self._client
+
+    def call(self, method, *args, **kwargs):
+        """Appel limité en débit, retenté après Retry-After sur une réponse 429"""
+        from spotipy import SpotifyException
+
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            with self._lock:
+                self.requests += 1
+            try:
+                return method(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.rate_limited += 1
+                retry_after = (e.headers or {}).get('Retry-After')
+                delay = float(retry_after) if retry_after else 2 ** attempt
+                logging.warning(f"Spotify 429, nouvel essai dans {delay:.0f}s")
+                self.bucket.pause(delay)
+
+    def playlist(self, playlist_id, fresh=False):
+        """Nom, snapshot_id et nombre de morceaux d'une playlist"""
+        meta = None if fresh else self.playlists.get(playlist_id)
+        if meta is None:
+            result = self.call(self.client.playlist, playlist_id, fields=self.PLAYLIST_FIELDS)
+            meta = {
+                'id': result['id'],
+                'name': result['name'],
+                'snapshot_id': result['snapshot_id'],
+                'total': result['tracks']['total']
+            }
+            self.playlists.set(playlist_id, meta)
+        return meta
+
+    def _page(self, playlist_id, offset):
+        return self.call(
+            self.client.playlist_items, playlist_id,
+            fields=self.TRACK_FIELDS, limit=SPOTIFY_PAGE_SIZE, offset=offset,
+            additional_types=('track',)
+        )
+
+    def playlist_tracks(self, playlist_id, snapshot_id=None):
+        """Morceaux d'une playlist, sans appel à Spotify si le snapshot est déjà connu"""
+        snapshot_id = snapshot_id or self.playlist(playlist_id)['snapshot_id']
+        key = (playlist_id, snapshot_id)
+        tracks = self.snapshots.get(key)
+        if tracks is not None:
+            return list(tracks)
+
+        # La première page donne le total, les suivantes partent en parallèle
+        first = self._page(playlist_id, 0)
+        offsets = range(SPOTIFY_PAGE_SIZE, first['total'], SPOTIFY_PAGE_SIZE)
+        pages = [first, *self._pages.map(lambda offset: self._page(playlist_id, offset), offsets)]
+        tracks = [
+            item['track']
+            for page in pages
+            for item in page['items']
+            if item.get('track')
+        ]
+        self.snapshots.set(key, tracks)
+        return list(tracks)
+
+    def metrics(self):
+        return {
+            'requests': self.requests,
+            'rate_limited': self.rate_limited,
+            'throttled_s': round(self.bucket.waited, 2),
+            'playlists': self.playlists.metrics(),
+            'snapshots': self.snapshots.metrics()
+        }
+
+spotify = SpotifyClient()
+
+def spotify_track_key(track):
+    """Identifiant stable d'un morceau Spotify (les fichiers locaux n'ont pas d'id)"""
+    if track.get('id'):
+        return track['id']
+    artists = ' '.join(artist['name'] for artist in track['artists'])
+    return f"local:{normalize_query(track['name'] + ' ' + artists)}"
+
+def title_tokens(text):
+    return set(fold_text(text).split()) - MATCH_STOPWORDS
+
+def match_features(track):
+    """Caractéristiques d'un morceau Spotify, calculées une fois pour tous ses candidats"""
+    # « Titre - Remastered 2011 » : seul le titre doit se retrouver sur YouTube
+    core_name = track['name'].split(' - ')[0]
+    name = title_tokens(core_name) or title_tokens(track['name'])
+    artists = set()
+    for artist in track['artists']:
+        artists |= title_tokens(artist['name'])
+    duration_ms = track.get('duration_ms')
+    return {
+        'name': name,
+        'artists': artists,
+        'known': title_tokens(track['name']) | artists,
+        'duration': duration_ms / 1000 if duration_ms else None
+    }
+
+def score_candidate(features, entry):
+    """Confiance entre 0 et 1 qu'un résultat YouTube (recherche « flat ») soit le bon morceau"""
+    title = title_tokens(entry.get('title'))
+    channel = title_tokens(entry.get('channel') or entry.get('uploader'))
+
+    name = len(features['name'] & title) / len(features['name']) if features['name'] else 0.5
+    artist = len(features['artists'] & (title | channel)) / len(features['artists']) if features['artists'] else 0.5
+    duration = 0.5
+    if features['duration'] and entry.get('duration'):
+        gap = abs(entry['duration'] - features['duration']) - MATCH_DURATION_TOLERANCE
+        duration = max(0.0, 1 - max(gap, 0) / MATCH_DURATION_RANGE)
+    penalty = sum(MATCH_PENALTIES[term] for term in title.intersection(MATCH_PENALTIES) - features['known'])
+    return round(max(0.4 * name + 0.25 * artist + 0.35 * duration - penalty, 0.0), 3)
+
+def best_match(track, entries):
+    """Meilleur candidat et son score ; à égalité, l'ordre de YouTube l'emporte"""
+    features = match_features(track)
+    best, best_score = None, -1.0
+    for entry in entries:
+        score = score_candidate(features, entry)
+        if score > best_score:
+            best, best_score = entry, score
+    return best, best_score
+
+@timed('resolve_track')
+def resolve_track(track):
+    """Cherche la vidéo YouTube correspondant à un morceau Spotify"""
+    artists = [artist['name'] for artist in track['artists']]
+    search_query = f"{track['name']} {' '.join(artists)}"
+    title = f"{track['name']} - {', '.join(artists)}"
+    spotify_id = spotify_track_key(track)
+
+    keys = match_cache_keys(track, search_query)
+    match = match_cache.get_first(keys)
+    if match:
+        if isinstance(match, str):
+            # Ancien format du cache : id seul, sans score
+            match = {'id': match, 'score': None}
+        return {'id': match['id'], 'title': title, 'spotify_id': spotify_id, 'match_score': match['score']}
+
+    try:
+        # Plusieurs candidats en une seule requête, classés sur les métadonnées Spotify
+        with extractors['search'].extractor() as ydl:
+            result = ydl.extract_info(f"ytsearch{MATCH_CANDIDATES}:{search_query}", download=False)
+        entries = [entry for entry in (result or {}).get('entries') or [] if entry and entry.get('id')]
+        if entries:
+            video, score = best_match(track, entries)
+            for key in keys:
+                match_cache.set(key, {'id': video['id'], 'score': score})
+            logging.info(f"Ajouté: {track['name']} (score {score})")
+            return {
+                'id': video['id'],
+                'title': title,
+                'spotify_id': spotify_id,
+                'match_score': score
+            }
+    except Exception as e:
+        logging.error(f"Erreur YouTube pour {search_query}: {str(e)}")
+    return None
+
+def resolve_tracks(tracks, pool=None, on_result=None):
+    """Résout les morceaux en parallèle en conservant l'ordre d'origine"""
+    pool = pool or import_executor
+    songs = []
+    for track, song in zip(tracks, pool.map(resolve_track, tracks)):
+        if song:
+            songs.append(song)
+        if on_result:
+            on_result(track, song)
+    return songs
+
+def run_import_job(job_id, playlist_id, playlist_name, snapshot_id=None):
+    """Importe une playlist Spotify en tâche de fond"""
+    source = {'kind': 'spotify', 'id': playlist_id, 'subscribed': False}
+    try:
+        tracks = spotify.playlist_tracks(playlist_id, snapshot_id)
+        total = len(tracks)
+        jobs.update(job_id, total=total)
+
+        start = time.time()
+        progress = {'resolved': 0, 'failed': 0}
+        pending = []
+
+        def on_result(track, song):
+            # Les morceaux sont ajoutés par lots, dans l'ordre Spotify : une entrée
+            # du journal et une écriture SQLite par lot plutôt que par morceau
+            if song:
+                pending.append(song)
+                progress['resolved'] += 1
+                if len(pending) >= IMPORT_BATCH_SIZE:
+                    playlists.add_songs(playlist_name, pending[:])
+                    pending.clear()
+            else:
+                progress['failed'] += 1
+            processed = progress['resolved'] + progress['failed']
+            elapsed = time.time() - start
+            jobs.update(
+                job_id,
+                resolved=progress['resolved'],
+                failed=progress['failed'],
+                current=track['name'],
+                eta=round(elapsed / processed * (total - processed), 1)
+            )
+
+        resolve_tracks(tracks, on_result=on_result)
+        if pending:
+            playlists.add_songs(playlist_name, pending)
+        save_match_cache()
+        # La source n'est enregistrée qu'une fois l'import complet : avant, une
+        # resynchronisation lancerait un second import sur la même playlist
+        playlists.set_source(playlist_name, **source, snapshot_id=snapshot_id, synced_at=time.time())
+        jobs.update(
+            job_id,
+            status='done',
+            eta=0,
+            message=f'Playlist "{playlist_name}" importée ({progress["resolved"]} morceaux)'
+        )
+    except Exception as e:
+        logging.error(f"Erreur d'importation: {str(e)}")
+        # Source sans snapshot : la prochaine resynchronisation complète l'import interrompu
+        if playlist_name in playlists:
+            playlists.set_source(playlist_name, **source)
+        jobs.update(job_id, status='error', error='Erreur lors de l\'importation')
+    finally:
+        with _resync_lock:
+            _import_jobs.pop(playlist_id, None)
+
+def run_resync_job(job_id, name):
+    """Aligne une playlist importée sur sa version Spotify actuelle"""
+    try:
+        source = playlists[name].source
+        meta = spotify.playlist(source['id'], fresh=True)
+        if meta['snapshot_id'] == source.get('snapshot_id'):
+            playlists.set_source(name, synced_at=time.time())
+            jobs.update(job_id, status='done', eta=0, message=f'Playlist "{name}" déjà à jour')
+            return
+
+        tracks = spotify.playlist_tracks(source['id'], meta['snapshot_id'])
+        keys = [spotify_track_key(track) for track in tracks]
+        known = {song.get('spotify_id') for song in playlists[name].songs()}
+        missing = [track for track, key in zip(tracks, keys) if key not in known]
+        jobs.update(job_id, total=len(missing))
+
+        # Seuls les morceaux ajoutés sur Spotify sont recherchés sur YouTube
+        resolved = {}
+        progress = {'resolved': 0, 'failed': 0}
+
+        def on_result(track, song):
+            if song:
+                resolved[song['spotify_id']] = song
+                progress['resolved'] += 1
+            else:
+                progress['failed'] += 1
+            jobs.update(job_id, current=track['name'], **progress)
+
+        resolve_tracks(missing, on_result=on_result)
+        save_match_cache()
+
+        wanted_keys = set(keys)
+        removed = []
+
+        def merge(current):
+            by_key = {song['spotify_id']: song for song in current if song.get('spotify_id')}
+            removed[:] = [key for key in by_key if key not in wanted_keys]
+            by_key.update(resolved)
+            wanted = [by_key[key] for key in keys if key in by_key]
+            # Les morceaux ajoutés à la main restent en fin de playlist
+            manual = [song for song in current if not song.get('spotify_id')]
+            return wanted + manual
+
+        playlists.update_songs(name, merge)
+        playlists.set_source(name, snapshot_id=meta['snapshot_id'], synced_at=time.time())
+        jobs.update(
+            job_id,
+            status='done',
+            eta=0,
+            added=progress['resolved'],
+            removed=len(removed),
+            message=f'Playlist "{name}" synchronisée (+{progress["resolved"]}, -{len(removed)})'
+        )
+    except Exception as e:
+        logging.error(f"Erreur de synchronisation de {name}: {str(e)}")
+        jobs.update(job_id, status='error', error='Erreur lors de la synchronisation')
+    finally:
+        with _resync_lock:
+            _resync_jobs.pop(name, None)
+
+# Une seule synchronisation en cours par playlist, un seul import par playlist Spotify
+_resync_jobs = {}
+_import_jobs = {}  # id Spotify -> (id de la tâche, nom de la playlist)
+_resync_lock = threading.Lock()
+
+def start_resync(name):
+    """Lance (ou rejoint) la synchronisation d'une playlist, retourne l'id de la tâche"""
+    with _resync_lock:
+        job_id = _resync_jobs.get(name)
+        if job_id:
+            return job_id
+        job_id = jobs.create(type='resync', playlist=name, total=0, resolved=0, failed=0, eta=None)
+        _resync_jobs[name] = job_id
+    executor.submit(run_resync_job, job_id, name)
+    return job_id
+
+def start_import(playlist_id, meta):
+    """Lance (ou rejoint) l'import d'une playlist Spotify, retourne (id de la tâche, nom)
+
+    Retourne None si un import de cette playlist vient de se terminer."""
+    with _resync_lock:
+        running = _import_jobs.get(playlist_id)
+        if running:
+            return running
+        if playlists.find_source('spotify', playlist_id):
+            return None
+        playlist_name = meta['name']
+        if playlist_name in playlists:
+            playlist_name = f"{playlist_name}_{len(playlists)}"
+        playlists.create(playlist_name)
+        job_id = jobs.create(
+            type='import',
+            playlist=playlist_name,
+            total=0,
+            resolved=0,
+            failed=0,
+            eta=None
+        )
+        _import_jobs[playlist_id] = job_id, playlist_name
+    executor.submit(run_import_job, job_id, playlist_id, playlist_name, meta['snapshot_id'])
+    return job_id, playlist_name
+
+def sync_subscriptions():
+    """Resynchronise périodiquement les playlists abonnées"""
+    while True:
+        time.sleep(SPOTIFY_SYNC_INTERVAL)
+        for name in playlists.subscribed():
+            start_resync(name)
 
 @app.route('/import-spotify', methods=['POST'])
+@limited('import')
 def import_spotify_playlist():
     spotify_url = request.json.get('url')
     if not spotify_url:
-        return jsonify({'success': False, 'error': 'URL manquante'})
+        return api_response({'success': False, 'error': 'URL manquante'})
     
     try:
         playlist_id = spotify_url.split('playlist/')[1].split('?')[0]
         
         try:
-            playlist = sp.playlist(playlist_id)
-            playlist_name = playlist['name']
-            
-            if playlist_name in playlists:
-                playlist_name = f"{playlist_name}_{len(playlists)}"
-            
-            playlists[playlist_name] = []
-            
-            results = sp.playlist_tracks(playlist_id)
-            tracks = results['items']
-            
-            while results['next']:
-                results = sp.next(results)
-                tracks.extend(results['items'])
-            
-            for item in tracks:
-                track = item['track']
-                if not track:
-                    continue
-                
-                artists = [artist['name'] for artist in track['artists']]
-                search_query = f"{track['name']} {' '.join(artists)}"
-                
-                with YoutubeDL(ydl_opts) as ydl:
-                    try:
-                        result = ydl.extract_info(f"ytsearch1:{search_query}", download=False)
-                        if 'entries' in result and result['entries']:
-                            video = result['entries'][0]
-                            playlists[playlist_name].append({
-                                'id': video['id'],
-                                'title': f"{track['name']} - {', '.join(artists)}"
-                            })
-                            logging.info(f"Ajouté: {track['name']}")
-                    except Exception as e:
-                        logging.error(f"Erreur YouTube pour {search_query}: {str(e)}")
-                        continue
-            
-            save_playlists(playlists)
-            return jsonify({
+            existing = playlists.find_source('spotify', playlist_id)
+            if not existing:
+                # Un import déjà en cours pour cette playlist est rejoint plutôt que relancé
+                started = start_import(playlist_id, spotify.playlist(playlist_id))
+                if started:
+                    job_id, playlist_name = started
+                    return api_response({
+                        'success': True,
+                        'job_id': job_id,
+                        'playlist': playlist_name,
+                        'message': f'Importation de "{playlist_name}" démarrée'
+                    })
+                existing = playlists.find_source('spotify', playlist_id)
+
+            # Playlist déjà importée : resynchronisation au lieu d'une copie
+            job_id = start_resync(existing)
+            return api_response({
                 'success': True,
-                'message': f'Playlist "{playlist_name}" importée ({len(playlists[playlist_name])} morceaux)'
+                'job_id': job_id,
+                'playlist': existing,
+                'message': f'Synchronisation de "{existing}" démarrée'
             })
             
-        except spotipy.SpotifyException as e:
+        except Exception as e:
+            if not is_spotify_error(e):
+                raise
             logging.error(f"Erreur Spotify: {str(e)}")
-            return jsonify({'success': False, 'error': 'Erreur d\'accès à Spotify'})
+            return api_response({'success': False, 'error': 'Erreur d\'accès à Spotify'})
             
     except Exception as e:
         logging.error(f"Erreur d'importation: {str(e)}")
-        return jsonify({'success': False, 'error': 'Erreur lors de l\'importation'})
+        return api_response({'success': False, 'error': 'Erreur lors de l\'importation'})
+
+@app.route('/playlist/<name>/resync', methods=['POST'])
+def resync_playlist(name):
+    playlist = playlists.get(name)
+    if playlist is None:
+        return api_response({'success': False, 'error': 'Playlist non trouvée'}), 404
+    if not playlist.source:
+        return api_response({'success': False, 'error': 'Playlist non importée depuis Spotify'}), 400
+    return api_response({'success': True, 'job_id': start_resync(name), 'playlist': name})
+
+@app.route('/playlist/<name>/subscription', methods=['PUT'])
+def playlist_subscription(name):
+    """Active ou coupe la synchronisation périodique d'une playlist importée"""
+    playlist = playlists.get(name)
+    if playlist is None:
+        return api_response({'success': False, 'error': 'Playlist non trouvée'}), 404
+    if not playlist.source:
+        return api_response({'success': False, 'error': 'Playlist non importée depuis Spotify'}), 400
+    subscribed = bool((request.get_json(silent=True) or {}).get('subscribed'))
+    return api_response({'success': True, 'source': playlists.set_source(name, subscribed=subscribed)})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return api_response({'success': False, 'error': 'Tâche introuvable'}), 404
+    return api_response({'success': True, 'job': job})
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Flux Server-Sent Events de la progression d'une tâche"""
+    job = jobs.get(job_id)
+    if not job:
+        return api_response({'success': False, 'error': 'Tâche introuvable'}), 404
+
+    def stream(job):
+        yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+        while job['status'] == 'running':
+            updated = jobs.wait(job_id, job['version'], timeout=JOB_EVENTS_KEEPALIVE)
+            if updated is None:
+                return
+            if updated['version'] == job['version']:
+                yield ": keep-alive\n\n"
+                continue
+            job = updated
+            yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+        yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+
+    return Response(stream(job), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/playlist', methods=['POST'])
 def create_playlist():
     data = request.json
     playlist_name = data.get('name')
     if playlist_name:
-        if playlist_name not in playlists:
-            playlists[playlist_name] = []
-            save_playlists(playlists)
-            return jsonify({'success': True})
-        return jsonify({'success': False, 'error': 'Playlist already exists'})
-    return jsonify({'success': False, 'error': 'Invalid playlist name'})
+        if playlists.create(playlist_name):
+            return api_response({'success': True})
+        return api_response({'success': False, 'error': 'Playlist already exists'})
+    return api_response({'success': False, 'error': 'Invalid playlist name'})
+
+def versioned_response(etag, render):
+    """Réponse JSON avec ETag : 304 si le client l'a déjà, sinon corps sérialisé une seule fois par version"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render(), mimetype='application/json')
+        response.enveloped = True
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/playlists', methods=['GET'])
 def get_playlists():
-    return jsonify({
-        'success': True,
-        'playlists': playlists
-    })
+    snapshot = playlists.snapshot()
+    return versioned_response(
+        f"{playlists.epoch}-{snapshot.version}",
+        lambda: snapshot.cached('playlists', snapshot.to_json)
+    )
+
+@app.route('/playlists/summary', methods=['GET'])
+def get_playlists_summary():
+    snapshot = playlists.snapshot()
+    return versioned_response(
+        f"{playlists.epoch}-summary-{snapshot.version}",
+        lambda: snapshot.render('summary', lambda: {
+            'success': True,
+            'version': snapshot.version,
+            'playlists': snapshot.summary()
+        })
+    )
+
+@app.route('/playlists/changes', methods=['GET'])
+def get_playlists_changes():
+    since = request.args.get('since', type=int)
+    if since is None:
+        return api_response({'success': False, 'error': 'Paramètre since manquant'}), 400
+
+    version = playlists.version
+    changes = playlists.changes_since(since)
+    if changes is None:
+        # Journal dépassé : le client doit recharger le résumé complet
+        return api_response({'success': True, 'version': version, 'reset': True, 'changes': []})
+    return api_response({'success': True, 'version': version, 'reset': False, 'changes': changes})
 
 @app.route('/playlist/<name>/add', methods=['POST'])
 def add_to_playlist(name):
     if not name or name not in playlists:
-        return jsonify({'success': False, 'error': 'Invalid playlist name'})
+        return api_response({'success': False, 'error': 'Invalid playlist name'})
     
     try:
-        song = request.json
-        if not song or 'id' not in song or 'title' not in song:
-            return jsonify({'success': False, 'error': 'Invalid song data'})
-            
-        if not any(s['id'] == song['id'] for s in playlists[name]):
-            playlists[name].append(song)
-            save_playlists(playlists)
-            return jsonify({'success': True})
-        return jsonify({'success': False, 'error': 'Song already in playlist'})
+        # Un morceau seul ou une liste de morceaux à ajouter en une fois
+        songs = request.json
+        if isinstance(songs, dict):
+            songs = [songs]
+        if not songs or not all(isinstance(s, dict) and 'id' in s and 'title' in s for s in songs):
+            return api_response({'success': False, 'error': 'Invalid song data'})
+
+        added = playlists.add_songs(name, songs)
+        if added:
+            if name in offline.pinned:
+                offline.enqueue(name)
+            return api_response({'success': True, 'added': len(added)})
+        return api_response({'success': False, 'error': 'Song already in playlist'})
     except Exception as e:
         logging.error(f"Error adding to playlist: {str(e)}")
-        return jsonify({'success': False, 'error': 'Failed to add song'})
+        return api_response({'success': False, 'error': 'Failed to add song'})
 
 @app.route('/playlist/<name>', methods=['GET'])
 def get_playlist(name):
-    if name in playlists:
-        return jsonify({
+    playlist = playlists.get(name)
+    if playlist is None:
+        return api_response({'success': False, 'error': 'Playlist not found'})
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+
+    def build():
+        if limit is None:
+            page = playlist[offset:]
+        else:
+            page = playlist[offset:offset + max(min(limit, PLAYLIST_PAGE_SIZE), 1)]
+        next_offset = offset + len(page)
+        return {
             'success': True,
-            'playlist': playlists[name],
-            'name': name
-        })
-    return jsonify({'success': False, 'error': 'Playlist not found'})
+            'playlist': page,
+            'name': name,
+            'total': len(playlist),
+            'version': playlist.version,
+            'next_offset': next_offset if next_offset < len(playlist) else None
+        }
+
+    etag = f"{playlists.epoch}-{playlist.version}-{offset}-{limit}"
+    return versioned_response(etag, lambda: playlist.render((offset, limit), build))
 
 @app.route('/playlist/<name>/remove/<song_id>', methods=['DELETE'])
 def remove_from_playlist(name, song_id):
     if name in playlists:
-        playlists[name] = [song for song in playlists[name] if song['id'] != song_id]
-        save_playlists(playlists)
-        return jsonify({'success': True})
-    return jsonify({'success': False, 'error': 'Playlist not found'})
+        playlists.remove_songs(name, [song_id])
+        return api_response({'success': True})
+    return api_response({'success': False, 'error': 'Playlist not found'})
+
+@app.route('/playlist/<name>/songs', methods=['DELETE'])
+def remove_many_from_playlist(name):
+    if name not in playlists:
+        return api_response({'success': False, 'error': 'Playlist not found'})
+    song_ids = (request.json or {}).get('ids')
+    if not isinstance(song_ids, list):
+        return api_response({'success': False, 'error': 'Invalid song ids'})
+    removed = playlists.remove_songs(name, song_ids)
+    return api_response({'success': True, 'removed': len(removed)})
+
+@app.route('/playlist/<name>/batch', methods=['POST'])
+def batch_playlist(name):
+    """Liste d'opérations add / remove / move appliquée d'un bloc"""
+    if name not in playlists:
+        return api_response({'success': False, 'error': 'Playlist not found'})
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list):
+        return api_response({'success': False, 'error': 'Invalid operations'}), 400
+    try:
+        added, removed, moved = playlists.apply_batch(name, operations)
+    except (TypeError, ValueError) as e:
+        # Rien n'a été appliqué
+        return api_response({'success': False, 'error': str(e)}), 400
+    if added and name in offline.pinned:
+        offline.enqueue(name)
+    return api_response({
+        'success': True,
+        'added': len(added),
+        'removed': len(removed),
+        'moved': moved,
+        'version': playlists[name].version
+    })
+
+@app.route('/playlist/<name>/merge', methods=['POST'])
+def merge_playlists(name):
+    """Ajoute les morceaux d'autres playlists (sans doublons), sources supprimées si demandé"""
+    if name not in playlists:
+        return api_response({'success': False, 'error': 'Playlist not found'})
+    data = request.get_json(silent=True) or {}
+    sources = data.get('sources')
+    if not isinstance(sources, list) or not sources or name in sources:
+        return api_response({'success': False, 'error': 'Invalid source playlists'}), 400
+    missing = [source for source in sources if source not in playlists]
+    if missing:
+        return api_response({'success': False, 'error': f"Playlist not found: {', '.join(missing)}"})
+
+    songs = [song for source in sources for song in playlists[source].songs()]
+    added, _, _ = playlists.apply_batch(name, [{'op': 'add', 'songs': songs}])
+    if added and name in offline.pinned:
+        offline.enqueue(name)
+    if data.get('delete_sources'):
+        for source in sources:
+            if source in offline.pinned:
+                offline.unpin(source)
+            playlists.delete(source)
+    return api_response({'success': True, 'added': len(added)})
+
+@app.route('/playlist/<name>/dedupe', methods=['POST'])
+def dedupe_playlist(name):
+    """Retire les doublons d'un même morceau sous des vidéos différentes (premier gardé)"""
+    playlist = playlists.get(name)
+    if playlist is None:
+        return api_response({'success': False, 'error': 'Playlist not found'})
+    seen = set()
+    duplicates = []
+    for song in playlist.songs():
+        key = song.get('spotify_id') or fold_text(song['title'])
+        if key in seen:
+            duplicates.append(song['id'])
+        else:
+            seen.add(key)
+    _, removed, _ = playlists.apply_batch(name, [{'op': 'remove', 'ids': duplicates}])
+    return api_response({'success': True, 'removed': len(removed)})
+
+@app.route('/playlist/<name>/copy', methods=['POST'])
+def copy_playlist(name):
+    playlist = playlists.get(name)
+    if playlist is None:
+        return api_response({'success': False, 'error': 'Playlist not found'})
+    new_name = (request.get_json(silent=True) or {}).get('name')
+    if not new_name:
+        return api_response({'success': False, 'error': 'Invalid playlist name'})
+    if not playlists.create(new_name, playlist.songs()):
+        return api_response({'success': False, 'error': 'Playlist already exists'})
+    return api_response({'success': True, 'name': new_name, 'count': len(playlists[new_name])})
+
+def export_lines(selected):
+    """Une ligne {"playlist": nom} puis une ligne par morceau, envoyées par blocs"""
+    chunk, size = [], 0
+    for playlist in selected:
+        lines = itertools.chain(
+            [json.dumps({'playlist': playlist.name, 'count': len(playlist)}, ensure_ascii=False)],
+            (json.dumps(song, ensure_ascii=False) for song in playlist)
+        )
+        for line in lines:
+            chunk.append(line)
+            size += len(line) + 1
+            if size >= EXPORT_CHUNK_SIZE:
+                yield '\n'.join(chunk) + '\n'
+                chunk, size = [], 0
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+def export_response(selected, filename):
+    return Response(
+        export_lines(selected),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{filename}.jsonl"'}
+    )
+
+@app.route('/playlist/<name>/export', methods=['GET'])
+def export_playlist(name):
+    playlist = playlists.get(name)
+    if playlist is None:
+        return api_response({'success': False, 'error': 'Playlist not found'}), 404
+    return export_response([playlist], clean_filename(name) or 'playlist')
+
+@app.route('/playlists/export', methods=['GET'])
+def export_playlists():
+    # Un seul instantané : l'export reste cohérent même si la bibliothèque change pendant l'envoi
+    return export_response(list(playlists.snapshot().playlists.values()), 'playlists')
+
+@app.route('/playlists/import', methods=['POST'])
+def import_playlists():
+    """Import JSON lines lu au fil de l'eau, morceaux écrits par lots de PLAYLIST_IMPORT_BATCH"""
+    # Les lignes de morceaux suivent une ligne {"playlist": nom}, ou vont dans ?name=
+    counts = {}
+    renamed = {}  # nom demandé -> nom créé, quand le nom demandé existait déjà
+    pending = []
+
+    def claim(name):
+        """Crée la playlist sous un nom libre : "Nom", sinon "Nom (2)", "Nom (3)"..."""
+        created, n = name, 1
+        while not playlists.create(created):
+            n += 1
+            created = f"{name} ({n})"
+        if created != name:
+            renamed[name] = created
+        counts[created] = 0
+        return created
+
+    current = request.args.get('name')
+    if current:
+        current = claim(current)
+
+    def flush():
+        if pending:
+            counts[current] = counts.get(current, 0) + len(playlists.add_songs(current, pending))
+            pending.clear()
+
+    line_number = 0
+    try:
+        # request.stream lit octet par octet pour trouver les fins de ligne : on le met en tampon
+        for line_number, line in enumerate(io.BufferedReader(request.stream, EXPORT_CHUNK_SIZE), 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError('objet JSON attendu')
+            if 'playlist' in item:
+                flush()
+                if not str(item['playlist']).strip():
+                    raise ValueError('nom de playlist vide')
+                current = claim(str(item['playlist']))
+            elif current is None:
+                raise ValueError('morceau sans playlist')
+            elif 'id' not in item or 'title' not in item:
+                raise ValueError('morceau sans id ou titre')
+            else:
+                pending.append(item)
+                if len(pending) >= PLAYLIST_IMPORT_BATCH:
+                    flush()
+        flush()
+    except ValueError as e:
+        # Les lots précédents restent importés : on indique où l'import s'est arrêté
+        flush()
+        return api_response({
+            'success': False,
+            'error': f"Ligne {line_number} invalide : {e}",
+            'imported': counts,
+            'renamed': renamed
+        }), 400
+    # Playlists toujours nouvelles : aucune n'est encore marquée hors-ligne
+    return api_response({'success': True, 'imported': counts, 'renamed': renamed})
+
+@app.route('/song/<song_id>/playlists', methods=['GET'])
+def song_playlists(song_id):
+    return api_response({'success': True, 'playlists': playlists.containing(song_id)})
 
 @app.route('/playlist/<name>', methods=['DELETE'])
 def delete_playlist(name):
     if name in playlists:
-        del playlists[name]
-        save_playlists(playlists)
-        return jsonify({'success': True})
-    return jsonify({'success': False, 'error': 'Playlist not found'})
+        if name in offline.pinned:
+            offline.unpin(name)
+        playlists.delete(name)
+        return api_response({'success': True})
+    return api_response({'success': False, 'error': 'Playlist not found'})
 
 @app.route('/playlist/<name>/rename', methods=['PUT'])
 def rename_playlist(name):
     try:
         if name not in playlists:
-            return jsonify({'success': False, 'error': 'Playlist non trouvée'})
+            return api_response({'success': False, 'error': 'Playlist non trouvée'})
         
         data = request.json
         new_name = data.get('newName')
         
         if not new_name:
-            return jsonify({'success': False, 'error': 'Nouveau nom invalide'})
+            return api_response({'success': False, 'error': 'Nouveau nom invalide'})
             
         if new_name in playlists:
-            return jsonify({'success': False, 'error': 'Ce nom de playlist existe déjà'})
+            return api_response({'success': False, 'error': 'Ce nom de playlist existe déjà'})
             
-        # Sauvegarder les données de la playlist
-        playlist_data = playlists[name]
-        # Supprimer l'ancienne clé
-        del playlists[name]
-        # Créer la nouvelle clé avec les mêmes données
-        playlists[new_name] = playlist_data
+        if not playlists.rename(name, new_name):
+            return api_response({'success': False, 'error': 'Ce nom de playlist existe déjà'})
         
-        save_playlists(playlists)
+        offline.rename(name, new_name)
         
-        return jsonify({
+        return api_response({
             'success': True,
             'oldName': name,
             'newName': new_name
         })
     except Exception as e:
         logging.error(f"Error renaming playlist: {str(e)}")
-        return jsonify({'success': False, 'error': 'Erreur lors du renommage'})
+        return api_response({'success': False, 'error': 'Erreur lors du renommage'})
 
 @app.route('/get-stats', methods=['GET'])
 def get_stats():
-    try:
-        current_stats = load_stats()
-        return jsonify({'success': True, 'stats': current_stats})
-    except Exception as e:
-        logging.error(f"Error in get_stats: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
+    return api_response({'success': True, 'stats': stats.totals()})
 
 @app.route('/save-stats', methods=['POST'])
 def save_stats_route():
@@ -536,19 +3559,45 @@ def save_stats_route():
         new_stats = request.json
         if not new_stats:
             raise ValueError("No stats data provided")
-        
-        current_stats = load_stats()
-        current_stats.update({
-            'totalSongsPlayed': new_stats.get('totalSongsPlayed', current_stats['totalSongsPlayed']),
-            'totalHoursPlayed': new_stats.get('totalHoursPlayed', current_stats['totalHoursPlayed'])
-        })
-        
-        if save_stats(current_stats):
-            return jsonify({'success': True})
-        return jsonify({'success': False, 'error': 'Failed to save stats'})
+
+        stats.set_totals(new_stats.get('totalSongsPlayed'), new_stats.get('totalHoursPlayed'))
+        return api_response({'success': True})
     except Exception as e:
         logging.error(f"Error in save_stats_route: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
+        return api_response({'success': False, 'error': str(e)})
+
+@app.route('/stats/events', methods=['POST'])
+def record_stats_events():
+    """Évènements d'écoute {id, seconds, playlist?, title?, new_play?}, seuls ou en liste"""
+    data = request.get_json(silent=True)
+    events = data if isinstance(data, list) else [data]
+    try:
+        for event in events:
+            if not isinstance(event, dict) or not event.get('id'):
+                raise ValueError("Évènement d'écoute invalide")
+            stats.record(
+                event['id'],
+                event.get('seconds', 0),
+                playlist=event.get('playlist'),
+                title=event.get('title'),
+                new_play=bool(event.get('new_play'))
+            )
+    except (TypeError, ValueError) as e:
+        return api_response({'success': False, 'error': str(e)}), 400
+    return api_response({'success': True, 'stats': stats.totals()})
+
+@app.route('/stats/top', methods=['GET'])
+def stats_top_tracks():
+    by = request.args.get('by', 'plays')
+    if by not in ('plays', 'seconds'):
+        return api_response({'success': False, 'error': 'Critère de tri invalide'}), 400
+    limit = max(min(request.args.get('limit', 10, type=int), 100), 1)
+    return api_response({'success': True, 'tracks': stats.top_tracks(limit, by)})
+
+@app.route('/stats/days', methods=['GET'])
+def stats_days():
+    days = max(min(request.args.get('days', 30, type=int), 366), 1)
+    return api_response({'success': True, 'days': stats.hours_per_day(days)})
 
 # Nouvelles fonctions utilitaires
 def clean_filename(filename):
@@ -564,9 +3613,13 @@ def get_file_size(filepath):
 
 def cleanup_downloads():
     """Nettoie les fichiers téléchargés trop anciens"""
+    # Les sous-dossiers sont ignorés : STREAM_DIR est évincé par taille dans StreamCache
+    # et PINNED_DIR (playlists hors-ligne) n'est jamais nettoyé automatiquement
     try:
         for file in os.listdir(DOWNLOAD_DIR):
             filepath = os.path.join(DOWNLOAD_DIR, file)
+            if not os.path.isfile(filepath):
+                continue
             if time.time() - os.path.getctime(filepath) > 86400:  # 24h
                 os.remove(filepath)
     except Exception as e:
@@ -576,48 +3629,72 @@ def cleanup_downloads():
 def shuffle_playlist(name):
     try:
         if name not in playlists:
-            return jsonify({'success': False, 'error': 'Playlist non trouvée'})
+            return api_response({'success': False, 'error': 'Playlist non trouvée'})
             
         import random
-        shuffled = playlists[name].copy()
+        shuffled = playlists[name].songs()
         random.shuffle(shuffled)
-        playlists[name] = shuffled
-        save_playlists(playlists)
+        playlists.replace_songs(name, shuffled)
         
-        return jsonify({'success': True, 'playlist': shuffled})
+        return api_response({'success': True, 'playlist': shuffled})
     except Exception as e:
         logging.error(f"Erreur shuffle: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+        return api_response({'success': False, 'error': str(e)})
 
 # Amélioration de la gestion des erreurs
 @app.errorhandler(413)
 def request_entity_too_large(error):
-    return jsonify({
+    return api_response({
         'success': False,
         'error': 'Fichier trop volumineux'
     }), 413
 
 @app.errorhandler(429)
 def too_many_requests(error):
-    return jsonify({
+    return api_response({
         'success': False,
         'error': 'Trop de requêtes'
-    }), 429
+    }), 429, {'Retry-After': '1'}
 
-def start_server():
-    """Démarre le serveur Flask"""
-    app.run(host='127.0.0.1', port=5000, debug=False, threaded=True)
+def start_server(port=5000):
+    """Démarre le serveur Flask sur un pool de SERVER_THREADS threads"""
+    server = PooledWSGIServer('127.0.0.1', port, app)
+    server.serve_forever()
 
-# Amélioration de la fonction principale
-if __name__ == '__main__':
+def load_state():
+    """Fichiers JSON d'état, lus après le démarrage du serveur"""
+    stats.load()
+    load_match_cache()
+    offline.load()
+
+def background_startup():
+    """Chargements et nettoyages qui ne doivent pas retarder l'ouverture de la fenêtre"""
     try:
-        # Nettoyage initial
+        load_state()
+        # Parcours complets de la bibliothèque et du dossier hors-ligne, hors du chemin de démarrage
+        playlists.index_titles()
+        offline.scan_usage()
+        stats.start()
+        # Reprise des téléchargements hors-ligne interrompus
+        offline.resume()
+        threading.Thread(target=sync_subscriptions, name='spotify-sync', daemon=True).start()
+        # Préchauffage des extracteurs (import de yt-dlp compris)
+        for pool in (extractors['search'], extractors['resolve']):
+            executor.submit(pool.prewarm)
         cleanup_downloads()
         cleanup_cache()
-        
-        # Démarrage du serveur
+    except Exception as e:
+        logging.error(f"Erreur au démarrage: {e}")
+
+# Amélioration de la fonction principale
+if __name__ == '__main__':
+    try:
+        # Démarrage du serveur, le reste se charge pendant l'ouverture de la fenêtre
         server_thread = threading.Thread(target=start_server, daemon=True)
         server_thread.start()
+        executor.submit(background_startup)
+
+        import webview
 
         # Configuration de la fenêtre
         window = webview.create_window(
@@ -631,6 +3708,8 @@ if __name__ == '__main__':
         
         # Gestionnaire de fermeture
         def on_closing():
+            stats.stop()
+            save_match_cache()
             cleanup_downloads()
             cleanup_cache()
             os._exit(0)
@@ -0,0 +1,1515 @@
+"""Benchmarks hors-ligne d'OpenPy Music Player.
+
+Les appels réseau (YouTube, Spotify) sont remplacés par des faux clients
+à latence configurable, afin de mesurer uniquement le coût de l'application.
+
+    python benchmark.py import --tracks 200 --latency 0.05
+    python benchmark.py suite --output bench.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import spotipy
+from werkzeug.serving import make_server
+
+import app
+
+
+class FakeYoutubeDL:
+    """Remplace YoutubeDL : latence fixe, taux d'erreur et taille des réponses configurables"""
+    instances = 0
+    calls = 0
+    errors = 0
+    rng = random.Random(0)
+    _lock = threading.Lock()
+
+    def __init__(self, opts=None, latency=0.05, fail=False, error_rate=0.0, results=1, payload=0):
+        self.latency = latency
+        self.fail = fail
+        self.error_rate = error_rate
+        self.results = results  # Résultats renvoyés au plus par recherche
+        self.payload = payload  # Octets de description ajoutés à chaque résultat
+        with FakeYoutubeDL._lock:
+            FakeYoutubeDL.instances += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    def extract_info(self, url, download=False):
+        with FakeYoutubeDL._lock:
+            FakeYoutubeDL.calls += 1
+            failed = self.fail or (self.error_rate and FakeYoutubeDL.rng.random() < self.error_rate)
+            if failed:
+                FakeYoutubeDL.errors += 1
+        time.sleep(self.latency)
+        if failed:
+            raise Exception("Fake extraction error")
+        if url.startswith('ytsearch'):
+            prefix, query = url.split(':', 1)
+            video_id = f"vid{abs(hash(query)) % 10 ** 8:08d}"
+            count = min(int(prefix[len('ytsearch'):] or 1), self.results)
+            return {'entries': [
+                {'id': video_id if rank == 0 else f"{video_id}r{rank}", 'title': query,
+                 **({'description': 'x' * self.payload} if self.payload else {})}
+                for rank in range(count)
+            ]}
+        video_id = url.rsplit('v=', 1)[-1]
+        expire = int(time.time()) + 21600
+        return {
+            'id': video_id,
+            'title': f"Video {video_id}",
+            'url': f"https://rr1.googlevideo.com/videoplayback?expire={expire}&id={video_id}"
+        }
+
+    @classmethod
+    def reset(cls, seed=None):
+        cls.instances = 0
+        cls.calls = 0
+        cls.errors = 0
+        if seed is not None:
+            cls.rng.seed(seed)
+
+
+def use_youtube_dl(factory):
+    """Remplace la classe YoutubeDL de l'application et vide les pools d'extracteurs"""
+    app.YoutubeDL = factory
+    for pool in app.extractors.values():
+        pool.clear()
+
+
+def fake_tracks(count):
+    """Génère des morceaux au format de l'API Spotify"""
+    return [
+        {
+            'id': f"sp{i:06d}",
+            'name': f"Track {i}",
+            'artists': [{'name': f"Artist {i % 50}"}],
+            'duration_ms': 180000 + i
+        }
+        for i in range(count)
+    ]
+
+
+def bench_import(args):
+    """Débit de résolution des morceaux selon le nombre de workers"""
+    use_youtube_dl(lambda opts=None: FakeYoutubeDL(opts, latency=args.latency))
+    tracks = fake_tracks(args.tracks)
+
+    print(f"{args.tracks} morceaux, latence simulée {args.latency * 1000:.0f} ms")
+    print(f"{'workers':>8} {'durée (s)':>10} {'morceaux/s':>11} {'instances':>10}")
+    for workers in args.workers:
+        use_youtube_dl(app.YoutubeDL)
+        FakeYoutubeDL.reset()
+        app.match_cache = app.LRUCache(app.MATCH_CACHE_SIZE, app.MATCH_CACHE_TTL)
+        pool = ThreadPoolExecutor(max_workers=workers)
+        start = time.perf_counter()
+        songs = app.resolve_tracks(tracks, pool)
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+
+        assert [s['title'].split(' - ')[0] for s in songs] == [t['name'] for t in tracks]
+        print(f"{workers:>8} {elapsed:>10.2f} {len(songs) / elapsed:>11.1f} {FakeYoutubeDL.instances:>10}")
+
+
+def bench_match_cache(args):
+    """Ré-import d'une playlist : cache de correspondances froid puis chaud"""
+    use_youtube_dl(lambda opts=None: FakeYoutubeDL(opts, latency=args.latency))
+    app.MATCH_CACHE_FILE = os.path.join(tempfile.mkdtemp(), 'matches.json')
+    tracks = fake_tracks(args.tracks)
+
+    print(f"{args.tracks} morceaux, latence simulée {args.latency * 1000:.0f} ms")
+    print(f"{'passe':>6} {'durée (s)':>10} {'extractions':>12} {'hits':>6} {'misses':>7}")
+    for label in ('froid', 'chaud'):
+        if label == 'chaud':
+            # Rechargement depuis le disque, comme après un redémarrage
+            app.save_match_cache()
+            app.match_cache = app.LRUCache(app.MATCH_CACHE_SIZE, app.MATCH_CACHE_TTL)
+            app.load_match_cache()
+        else:
+            app.match_cache = app.LRUCache(app.MATCH_CACHE_SIZE, app.MATCH_CACHE_TTL)
+        FakeYoutubeDL.reset()
+        start = time.perf_counter()
+        app.resolve_tracks(tracks)
+        elapsed = time.perf_counter() - start
+        metrics = app.match_cache.metrics()
+        print(f"{label:>6} {elapsed:>10.3f} {FakeYoutubeDL.calls:>12} {metrics['hits']:>6} {metrics['misses']:>7}")
+
+
+def bench_single_flight(args):
+    """Requêtes concurrentes sur une même vidéo : une seule extraction attendue"""
+    for fail in (False, True):
+        use_youtube_dl(lambda opts=None: FakeYoutubeDL(opts, latency=args.latency, fail=fail))
+        app.audio_cache = app.LRUCache(app.MAX_CACHE_SIZE, app.CACHE_TIMEOUT)
+        app.audio_flight = app.SingleFlight(negative_ttl=app.NEGATIVE_CACHE_TTL)
+
+        for burst in ('premier', 'second'):
+            FakeYoutubeDL.reset()
+            barrier = threading.Barrier(args.requests)
+
+            def request():
+                barrier.wait()
+                return app.get_audio_url('dQw4w9WgXcQ')
+
+            with ThreadPoolExecutor(max_workers=args.requests) as pool:
+                results = list(pool.map(lambda _: request(), range(args.requests)))
+
+            ok = sum(1 for r in results if r)
+            label = 'échec' if fail else 'succès'
+            print(f"{label:>7} / {burst:>7} : {args.requests} requêtes, "
+                  f"{FakeYoutubeDL.calls} extraction(s), {ok} réponses valides")
+            expected = 1 if burst == 'premier' else 0
+            assert FakeYoutubeDL.calls == expected, FakeYoutubeDL.calls
+
+
+def fake_library(playlists, songs):
+    """Bibliothèque synthétique : `playlists` playlists de `songs` morceaux"""
+    return {
+        f"Playlist {p}": [
+            {'id': f"v{p:03d}{i:05d}", 'title': f"Track {i} - Artist {i % 50}"}
+            for i in range(songs)
+        ]
+        for p in range(playlists)
+    }
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def bench_storage(args):
+    """Latence par mutation : réécriture complète du JSON contre SQLite"""
+    workdir = tempfile.mkdtemp()
+    library = fake_library(args.playlists, args.songs)
+    json_file = os.path.join(workdir, 'playlists.json')
+
+    def json_save():
+        # Ancien chemin : tout le dictionnaire réécrit à chaque modification
+        with open(json_file, 'w') as f:
+            json.dump(library, f, indent=2)
+
+    store = app.PlaylistStore(os.path.join(workdir, 'playlists.db'))
+    for name, songs in library.items():
+        store.create(name, songs)
+
+    def measure(label, operation):
+        samples = []
+        for i in range(args.ops):
+            start = time.perf_counter()
+            operation(i)
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"{label:<22} médiane {statistics.median(samples):8.3f} ms   p95 {percentile(samples, 95):8.3f} ms")
+
+    target = 'Playlist 0'
+    print(f"{args.playlists} playlists x {args.songs} morceaux, {args.ops} opérations")
+
+    def json_add(i):
+        library[target].append({'id': f"new{i}", 'title': 'New'})
+        json_save()
+
+    def json_remove(i):
+        library[target] = [s for s in library[target] if s['id'] != f"new{i}"]
+        json_save()
+
+    measure('JSON ajout', json_add)
+    measure('JSON suppression', json_remove)
+    measure('SQLite ajout', lambda i: store.add_songs(target, [{'id': f"new{i}", 'title': 'New'}]))
+    measure('SQLite suppression', lambda i: store.remove_songs(target, [f"new{i}"]))
+    measure('SQLite renommage', lambda i: store.rename(
+        target if i % 2 == 0 else f"{target} bis", f"{target} bis" if i % 2 == 0 else target))
+
+
+def bench_envelope(args):
+    """Surcoût par requête du contrôle de format des réponses JSON"""
+    name = 'Grosse playlist'
+    # Bibliothèque temporaire : les playlists de l'utilisateur ne sont jamais touchées
+    workdir = sandbox({})
+    if not app.playlists.create(name, fake_library(1, args.songs)['Playlist 0']):
+        sys.exit(f"Impossible de créer la playlist {name!r}")
+    client = app.app.test_client()
+
+    try:
+        print(f"GET /playlist/<name> sur {args.songs} morceaux, {args.requests} requêtes")
+        for label, strict in (('avant (relecture)', True), ('après (enveloppe)', False)):
+            app.app.config['STRICT_RESPONSES'] = strict
+            samples = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                response = client.get(f'/playlist/{name}')
+                samples.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200
+            print(f"{label:<20} médiane {statistics.median(samples):8.3f} ms   p95 {percentile(samples, 95):8.3f} ms")
+    finally:
+        app.app.config['STRICT_RESPONSES'] = False
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_extractor_pool(args):
+    """Coût par appel : YoutubeDL construit à chaque appel contre pool préchauffé"""
+    from yt_dlp import YoutubeDL
+
+    class StubbedYoutubeDL(YoutubeDL):
+        # Vraie construction (options, extracteurs, cache), réseau remplacé
+        def extract_info(self, url, download=False, **kwargs):
+            return {'entries': [{'id': 'dQw4w9WgXcQ', 'title': url}]}
+
+    print(f"{args.calls} appels, réseau simulé (latence nulle)")
+
+    start = time.perf_counter()
+    for i in range(args.calls):
+        with StubbedYoutubeDL(dict(app.ydl_opts)) as ydl:
+            ydl.extract_info(f"ytsearch1:query {i}")
+    per_call = (time.perf_counter() - start) * 1000 / args.calls
+    print(f"{'construction par appel':<24} {per_call:8.3f} ms/appel")
+
+    use_youtube_dl(StubbedYoutubeDL)
+    pool = app.extractors['search']
+    pool.prewarm()
+    start = time.perf_counter()
+    for i in range(args.calls):
+        with pool.extractor() as ydl:
+            ydl.extract_info(f"ytsearch1:query {i}")
+    per_call = (time.perf_counter() - start) * 1000 / args.calls
+    print(f"{'pool préchauffé':<24} {per_call:8.3f} ms/appel   {pool.metrics()}")
+
+
+def http_get(url):
+    """GET bloquant, retourne le code HTTP (erreurs comprises)"""
+    try:
+        with urllib.request.urlopen(url, timeout=120) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serveur amont simulé : un fichier audio servi par plages, comme googlevideo"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = self.server.data
+        self.server.requests += 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(data)}")
+        else:
+            start, end = 0, len(data) - 1
+            self.send_response(200)
+        body = data[start:end + 1]
+        self.server.bytes += len(body)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def range_server(size, seed=0):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.daemon_threads = True
+    server.data = random.Random(seed).randbytes(size)
+    server.requests = 0
+    server.bytes = 0
+    server.base = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_stream(args):
+    """Proxy /stream contre un serveur amont local : plages partielles, suffixes, ouvertes, disque, erreurs, éviction"""
+    segment = app.STREAM_SEGMENT_SIZE
+    size = int(args.segments * segment)
+    upstream = range_server(size, args.seed)
+    data = upstream.data
+    workdir = tempfile.mkdtemp(prefix='openpy-bench-')
+    app.stream_cache = app.StreamCache(workdir)
+    app.audio_cache = app.LRUCache(app.MAX_CACHE_SIZE, app.CACHE_TIMEOUT)
+    for video_id in ('bench', 'other'):
+        app.audio_cache.set(video_id, {'url': f"{upstream.base}/{video_id}", 'title': video_id})
+    client = app.app.test_client()
+
+    cases = [
+        ('partielle', 'bytes=100-199', 206, data[100:200]),
+        ('répétée (disque)', 'bytes=100-199', 206, data[100:200]),
+        ('suffixe', 'bytes=-500', 206, data[-500:]),
+        ('ouverte', f"bytes={segment + 10}-", 206, data[segment + 10:]),
+        ('à cheval', f"bytes={segment - 10}-{segment + 9}", 206, data[segment - 10:segment + 10]),
+        ('entier', None, 200, data),
+        ('entier (disque)', None, 200, data),
+        ('hors fichier', f"bytes={size}-", 416, b''),
+        ('multiple ignorée', 'bytes=0-1,5-6', 200, data),
+        ('inversée ignorée', 'bytes=10-5', 200, data)
+    ]
+    failures = 0
+    print(f"{'requête':<18} {'statut':>6} {'octets':>9} {'amont':>6} {'durée':>9}")
+    for label, header, status, expected in cases:
+        requests = upstream.requests
+        start = time.perf_counter()
+        response = client.get('/stream/bench', headers={'Range': header} if header else {})
+        body = response.get_data()
+        elapsed = (time.perf_counter() - start) * 1000
+        response.close()
+        ok = response.status_code == status and body == expected
+        if label.endswith('(disque)'):
+            ok = ok and upstream.requests == requests
+        failures += not ok
+        print(f"{label:<18} {response.status_code:>6} {len(body):>9} {upstream.requests - requests:>6} "
+              f"{elapsed:>6.1f} ms{'' if ok else '  ÉCHEC'}")
+
+    # Éviction pendant qu'un autre flux télécharge : le fichier occupé est sauté, sans attendre
+    busy = app.stream_cache.get('bench')
+    app.stream_cache.max_size = segment
+    with busy.lock:
+        start = time.perf_counter()
+        app.stream_cache.ensure_segment(app.stream_cache.get('other'), 0)
+        elapsed = (time.perf_counter() - start) * 1000
+    skipped = 'bench' in app.stream_cache._files
+    failures += not skipped
+    print(f"éviction avec un fichier occupé : {elapsed:.1f} ms, fichier occupé {'gardé' if skipped else 'évincé'}")
+    print(f"amont : {upstream.requests} requêtes, {upstream.bytes / 1024:.0f} Ko pour {size / 1024:.0f} Ko de fichier")
+
+    upstream.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+    if failures:
+        print(f"{failures} vérifications en échec")
+        sys.exit(1)
+    print('vérifications : OK')
+
+
+def bench_load(args):
+    """Rafale de /play lents pendant des lectures CRUD : serveur threadé contre pool borné"""
+    use_youtube_dl(lambda opts=None: FakeYoutubeDL(opts, latency=args.latency))
+    default_limiters = app.limiters
+    unlimited = {name: app.EndpointLimiter(name, 10 ** 6, 0) for name in app.ENDPOINT_LIMITS}
+
+    print(f"{args.clients} clients x {args.requests} /play, extraction simulée {args.latency * 1000:.0f} ms")
+    print(f"{'serveur':<10} {'200':>5} {'429':>5} {'autres':>7} {'threads max':>12} "
+          f"{'CRUD médiane':>13} {'CRUD p95':>9}")
+    # Journal d'accès werkzeug coupé pendant la rafale
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    for run, label in enumerate(('threadé', 'borné')):
+        if label == 'threadé':
+            server = make_server('127.0.0.1', 0, app.app, threaded=True)
+            app.limiters = unlimited
+        else:
+            server = app.PooledWSGIServer('127.0.0.1', 0, app.app)
+            app.limiters = default_limiters
+        app.audio_cache = app.LRUCache(app.MAX_CACHE_SIZE, app.CACHE_TIMEOUT)
+        base = f"http://127.0.0.1:{server.socket.getsockname()[1]}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        done = threading.Event()
+        crud_samples = []
+        peak_threads = [threading.active_count()]
+
+        def crud():
+            # Lecture des playlists en continu pendant la rafale
+            while not done.is_set():
+                start = time.perf_counter()
+                http_get(f"{base}/playlists/summary")
+                crud_samples.append((time.perf_counter() - start) * 1000)
+                peak_threads[0] = max(peak_threads[0], threading.active_count())
+                time.sleep(0.01)
+
+        def client(c):
+            return [http_get(f"{base}/play/r{run}c{c:03d}i{i:04d}") for i in range(args.requests)]
+
+        crud_thread = threading.Thread(target=crud)
+        crud_thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=args.clients) as pool:
+                statuses = [code for codes in pool.map(client, range(args.clients)) for code in codes]
+        finally:
+            done.set()
+            crud_thread.join()
+            server.shutdown()
+            server.server_close()
+            app.limiters = default_limiters
+
+        ok = statuses.count(200)
+        throttled = statuses.count(429)
+        # Les threads clients du benchmark sont comptés dans le maximum
+        print(f"{label:<10} {ok:>5} {throttled:>5} {len(statuses) - ok - throttled:>7} {peak_threads[0]:>12} "
+              f"{statistics.median(crud_samples):>10.1f} ms {percentile(crud_samples, 95):>6.1f} ms")
+
+
+MARKETS = [f"{chr(65 + i // 26)}{chr(65 + i % 26)}" for i in range(80)]
+
+
+def spotify_track(i):
+    """Morceau au format complet de l'API Spotify (avec les champs inutiles à l'import)"""
+    return {
+        'id': f"sp{i:06d}",
+        'name': f"Track {i}",
+        'duration_ms': 180000 + i,
+        'artists': [{'name': f"Artist {i % 50}", 'id': f"ar{i % 50}", 'uri': f"spotify:artist:ar{i % 50}"}],
+        'album': {
+            'name': f"Album {i % 100}",
+            'release_date': '2020-01-01',
+            'images': [{'url': f"https://i.scdn.co/image/{i:040d}", 'height': h, 'width': h} for h in (640, 300, 64)],
+            'available_markets': MARKETS
+        },
+        'available_markets': MARKETS,
+        'external_urls': {'spotify': f"https://open.spotify.com/track/sp{i:06d}"},
+        'popularity': i % 100,
+        'preview_url': f"https://p.scdn.co/mp3-preview/{i:040d}"
+    }
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    """API Spotify simulée : playlists, pages de morceaux, filtre `fields` et 429 injectés"""
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes += len(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        with server.lock:
+            server.requests += 1
+            throttled = server.throttle_every and server.requests % server.throttle_every == 0
+            failed = server.error_rate and server.rng.random() < server.error_rate
+        time.sleep(server.latency)
+        if failed:
+            return self.send_json(500, {'error': {'status': 500, 'message': 'Fake server error'}})
+        if throttled:
+            return self.send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                                  {'Retry-After': str(server.retry_after)})
+
+        filtered = 'fields' in query
+        parts = url.path.strip('/').split('/')  # v1/playlists/<id>[/items]
+        if len(parts) == 3:
+            if filtered:
+                return self.send_json(200, {'id': parts[2], 'name': 'Fake playlist',
+                                            'snapshot_id': server.snapshot_id,
+                                            'tracks': {'total': len(server.order)}})
+            return self.send_json(200, {'id': parts[2], 'name': 'Fake playlist',
+                                        'snapshot_id': server.snapshot_id,
+                                        'description': 'x' * 300,
+                                        'tracks': self.page(parts[2], 0, 100, False)})
+
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', ['100'])[0])
+        self.send_json(200, self.page(parts[2], offset, limit, filtered))
+
+    def page(self, playlist_id, offset, limit, filtered):
+        server = self.server
+        indexes = server.order[offset:offset + limit]
+        total = len(server.order)
+        if filtered:
+            return {'total': total, 'items': [
+                {'track': {'id': f"sp{i:06d}", 'name': f"Track {i}", 'duration_ms': 180000 + i,
+                           'artists': [{'name': f"Artist {i % 50}"}]}}
+                for i in indexes
+            ]}
+        next_offset = offset + limit
+        return {
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'next': f"{server.base}/v1/playlists/{playlist_id}/items?offset={next_offset}&limit={limit}"
+            if next_offset < total else None,
+            'items': [
+                {'added_at': '2024-01-01T00:00:00Z', 'added_by': {'id': 'user'}, 'is_local': False,
+                 'track': spotify_track(i), **({'padding': 'x' * server.payload} if server.payload else {})}
+                for i in indexes
+            ]
+        }
+
+
+def fake_spotify_server(tracks, latency, throttle_every, retry_after=1, error_rate=0.0, payload=0, seed=0):
+    """Démarre l'API Spotify simulée sur un port libre"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSpotifyHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.order = list(range(tracks))  # Indices des morceaux, dans l'ordre de la playlist
+    server.latency = latency
+    server.throttle_every = throttle_every
+    server.retry_after = retry_after
+    server.error_rate = error_rate  # Part des requêtes en erreur 500
+    server.payload = payload  # Octets ajoutés à chaque morceau des réponses non filtrées
+    server.rng = random.Random(seed)
+    server.snapshot_id = 'snap-1'
+    server.requests = 0
+    server.bytes = 0
+    server.base = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def spotify_client(server, **kwargs):
+    client = spotipy.Spotify(auth='fake-token', **kwargs)
+    client.prefix = f"{server.base}/v1/"
+    return client
+
+
+def bench_spotify(args):
+    """Récupération d'une playlist Spotify : pages en série contre SpotifyClient"""
+    server = fake_spotify_server(args.tracks, args.latency, args.throttle_every)
+    playlist_id = 'fakeplaylist'
+
+    def serial():
+        # Ancien chemin : playlist complète puis pages suivies une à une
+        client = spotify_client(server)
+        client.playlist(playlist_id)
+        results = client.playlist_items(playlist_id)
+        items = results['items']
+        while results['next']:
+            results = client.next(results)
+            items.extend(results['items'])
+        return [item['track'] for item in items if item.get('track')]
+
+    wrapper = app.SpotifyClient(
+        spotify_client(server, requests_session=app.spotify_session()),
+        rate=args.rate, burst=args.burst
+    )
+
+    def wrapped():
+        meta = wrapper.playlist(playlist_id)
+        return wrapper.playlist_tracks(playlist_id, meta['snapshot_id'])
+
+    print(f"{args.tracks} morceaux, latence simulée {args.latency * 1000:.0f} ms, "
+          f"429 toutes les {args.throttle_every} requêtes, débit {args.rate}/s")
+    print(f"{'passe':<16} {'durée (s)':>10} {'requêtes':>9} {'Ko reçus':>9}")
+    expected = None
+    for label, fetch in (('séquentiel', serial), ('SpotifyClient', wrapped), ('ré-import', wrapped)):
+        server.requests = server.bytes = 0
+        start = time.perf_counter()
+        tracks = fetch()
+        elapsed = time.perf_counter() - start
+        ids = [track['id'] for track in tracks]
+        expected = expected or ids
+        assert ids == expected and len(ids) == args.tracks
+        print(f"{label:<16} {elapsed:>10.2f} {server.requests:>9} {server.bytes / 1024:>9.0f}")
+    print(f"SpotifyClient : {wrapper.metrics()['rate_limited']} réponse(s) 429 respectée(s)")
+    server.shutdown()
+
+
+def bench_resync(args):
+    """Resynchronisation d'une playlist importée après quelques changements côté Spotify"""
+    server = fake_spotify_server(args.tracks, 0.01, 0)
+    app.spotify = app.SpotifyClient(spotify_client(server, requests_session=app.spotify_session()),
+                                    rate=1000, burst=1000)
+    use_youtube_dl(lambda opts=None: FakeYoutubeDL(opts, latency=args.latency))
+    workdir = tempfile.mkdtemp()
+    app.MATCH_CACHE_FILE = os.path.join(workdir, 'matches.json')
+    app.store = app.PlaylistStore(os.path.join(workdir, 'playlists.db'))
+    app.playlists = app.Library(app.store, {})
+
+    def run(job, *job_args):
+        job_id = app.jobs.create(type='bench', total=0, resolved=0, failed=0, eta=None)
+        start = time.perf_counter()
+        FakeYoutubeDL.reset()
+        job(job_id, *job_args)
+        elapsed = time.perf_counter() - start
+        return app.jobs.get(job_id), elapsed, FakeYoutubeDL.calls
+
+    name = 'Fake playlist'
+    app.playlists.create(name)
+    app.playlists.set_source(name, kind='spotify', id='fakeplaylist', subscribed=False)
+    print(f"{args.tracks} morceaux, recherche YouTube simulée {args.latency * 1000:.0f} ms, "
+          f"{args.added} ajoutés, {args.removed} retirés, {args.moved} déplacés")
+    print(f"{'passe':<14} {'durée (s)':>10} {'recherches':>11}  résultat")
+
+    meta = app.spotify.playlist('fakeplaylist')
+    version = app.playlists.version
+    job, elapsed, calls = run(app.run_import_job, 'fakeplaylist', name, meta['snapshot_id'])
+    print(f"{'import':<14} {elapsed:>10.2f} {calls:>11}  {job['message']}")
+    # Une modification par lot de morceaux résolus (plus celle de la source)
+    batches = -(-args.tracks // app.IMPORT_BATCH_SIZE)
+    assert app.playlists.version - version <= batches + 1, 'import non regroupé par lots'
+
+    # Modifications côté Spotify : nouveau snapshot
+    order = server.order
+    del order[:args.removed]
+    for i in range(args.moved):
+        order.append(order.pop(i))
+    order.extend(range(args.tracks, args.tracks + args.added))
+    server.snapshot_id = 'snap-2'
+    # Cache de correspondances vidé : seules les recherches demandées par le diff sont comptées
+    app.match_cache = app.LRUCache(app.MATCH_CACHE_SIZE, app.MATCH_CACHE_TTL)
+
+    for label in ('resync', 'resync à jour'):
+        job, elapsed, calls = run(app.run_resync_job, name)
+        print(f"{label:<14} {elapsed:>10.2f} {calls:>11}  {job['message']}")
+
+    ids = [song['spotify_id'] for song in app.playlists[name].songs()]
+    assert ids == [f"sp{i:06d}" for i in order], 'ordre différent de Spotify'
+    server.shutdown()
+
+
+MATCH_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'matching.json')
+
+
+def bench_matching(args):
+    """Précision et coût du classement des candidats YouTube (jeu annoté fixtures/matching.json)"""
+    with open(MATCH_FIXTURES, encoding='utf-8') as f:
+        cases = json.load(f)['cases']
+
+    first = sum(case['candidates'][0]['id'] == case['expected'] for case in cases)
+    ranked = 0
+    for case in cases:
+        video, score = app.best_match(case['track'], case['candidates'])
+        if video['id'] == case['expected']:
+            ranked += 1
+        else:
+            print(f"  raté : {case['note']} (attendu {case['expected']}, choisi {video['id']}, score {score})")
+    print(f"{len(cases)} cas annotés")
+    print(f"{'premier résultat':<18} {first:>3}/{len(cases)} ({first / len(cases):.0%})")
+    print(f"{'classement':<18} {ranked:>3}/{len(cases)} ({ranked / len(cases):.0%})")
+
+    # Coût : `tracks` morceaux x 5 candidats, construits à partir du jeu annoté
+    batch = [cases[i % len(cases)] for i in range(args.tracks)]
+    samples = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for case in batch:
+            app.best_match(case['track'], case['candidates'])
+        samples.append((time.perf_counter() - start) * 1000)
+    candidates = sum(len(case['candidates']) for case in batch)
+    print(f"{args.tracks} morceaux x {candidates // args.tracks} candidats : "
+          f"médiane {statistics.median(samples):.1f} ms ({statistics.median(samples) * 1000 / candidates:.1f} µs/candidat)")
+
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def import_times():
+    """Temps d'import de app et de ses dépendances directes (python -X importtime), en ms"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=APP_DIR, capture_output=True, text=True, check=True)
+    modules, children = {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        # Les imports d'un module sont listés juste avant lui, un niveau plus bas
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1000
+        elif depth == 0:
+            if name.strip() == 'app':
+                modules = {**children, 'app': int(cumulative) / 1000}
+            children = {}
+    return modules
+
+
+def time_to_first_200(port):
+    """Secondes entre le lancement du processus serveur et le premier 200 sur /"""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', f'import app; app.start_server({port})'],
+                               cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                if http_get(f"http://127.0.0.1:{port}/") == 200:
+                    return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            if process.poll() is not None:
+                raise RuntimeError('Le serveur s\'est arrêté au démarrage')
+            time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_startup(args):
+    """Temps de démarrage : import de app (importtime) et premier 200 sur /"""
+    runs = [import_times() for _ in range(args.runs)]
+    print(f"import app : médiane {statistics.median(r['app'] for r in runs):.0f} ms sur {args.runs} lancements")
+    heaviest = sorted((name for name in runs[0] if name != 'app'),
+                      key=lambda name: -statistics.median(r.get(name, 0) for r in runs))
+    for name in heaviest[:args.top]:
+        print(f"  {name:<28} {statistics.median(r.get(name, 0) for r in runs):8.1f} ms")
+    lazy = [name for name in ('yt_dlp', 'spotipy', 'webview', 'pystray', 'PIL') if name in runs[0]]
+    print(f"modules lourds importés au démarrage : {', '.join(lazy) or 'aucun'}")
+
+    samples = [time_to_first_200(free_port()) for _ in range(args.runs)]
+    print(f"premier 200 sur / : médiane {statistics.median(samples) * 1000:.0f} ms, "
+          f"max {max(samples) * 1000:.0f} ms")
+
+
+def bench_metrics_overhead(args):
+    """Coût des histogrammes de latence, seul et rapporté à une requête servie depuis le cache (borné par --budget)"""
+    def loop(body):
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            body()
+        return (time.perf_counter() - start) / args.calls * 1e6
+
+    def bare():
+        pass
+
+    def measured():
+        with app.timed('benchmark'):
+            pass
+
+    per_call = statistics.median(loop(measured) - loop(bare) for _ in range(5))
+    print(f"timed() : {per_call:.2f} µs par mesure ({args.calls} appels)")
+
+    # Même mesure depuis plusieurs threads sur un seul histogramme (verrou partagé)
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        contended = statistics.median(pool.map(lambda _: loop(measured) - loop(bare), range(args.threads)))
+    print(f"timed() : {contended:.2f} µs par mesure sur {args.threads} threads")
+    # Compteur public de l'histogramme : chaque mesure a été enregistrée, y compris sous contention
+    recorded = app.latency('benchmark').metrics()['count']
+    assert recorded == (5 + args.threads) * args.calls, f"{recorded} mesures enregistrées"
+
+    app.audio_cache.set('bench', {'url': 'https://example.com/a', 'title': 'Bench'})
+    app.search_cache.set(app.normalize_query('bench'), [{'id': 'bench', 'title': 'Bench'}])
+    client = app.app.test_client()
+    # Une mesure par requête : get_audio_url pour /play, la recherche pour /search
+    for label, call in (
+        ('/play (cache)', lambda: client.get('/play/bench')),
+        ('/search (cache)', lambda: client.post('/search', json={'query': 'bench'}))
+    ):
+        samples = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = call()
+            samples.append((time.perf_counter() - start) * 1e6)
+            assert response.status_code == 200
+        median = statistics.median(samples)
+        print(f"{label:<16} médiane {median:8.1f} µs, histogramme {per_call / median:6.2%} de la requête")
+        assert per_call / median <= args.budget, f"{label} : mesure au-delà de {args.budget:.0%} de la requête"
+
+    # Les requêtes servies ont bien été comptées dans les métriques publiques
+    metrics = client.get('/metrics').get_json()['metrics']
+    assert metrics['latency']['audio_url']['count'] >= args.requests, 'requêtes /play non mesurées'
+    assert metrics['search']['latency']['count'] >= args.requests, 'requêtes /search non mesurées'
+    app.latencies.pop('benchmark', None)
+
+
+def latency_summary(samples):
+    """Percentiles (ms) d'une série de durées"""
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'max_ms': round(max(samples), 3)
+    }
+
+
+class ClientTransport:
+    """Requêtes via le client de test Flask, sans socket (un client par thread)"""
+    name = 'client'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = app.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+    def close(self):
+        pass
+
+
+class ServerTransport:
+    """Requêtes HTTP vers un vrai serveur local, le même que l'application"""
+    name = 'server'
+
+    def __init__(self):
+        self.server = app.PooledWSGIServer('127.0.0.1', 0, app.app)
+        self.base = f"http://127.0.0.1:{self.server.socket.getsockname()[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(
+            f"{self.base}{path}", data=data, method=method,
+            headers={'Content-Type': 'application/json'} if data is not None else {}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            return status, None
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+TRANSPORTS = {'client': ClientTransport, 'server': ServerTransport}
+
+
+def sandbox(library):
+    """Données de l'application dans un dossier temporaire, préremplies avec `library`"""
+    workdir = tempfile.mkdtemp(prefix='openpy-bench-')
+    app.MATCH_CACHE_FILE = os.path.join(workdir, 'matches.json')
+    app.store = app.PlaylistStore(os.path.join(workdir, 'playlists.db'))
+    for name, songs in library.items():
+        app.store.create(name, songs)
+    app.playlists = app.Library(app.store, app.store.load_all(), app.store.load_sources())
+    app.playlists.index_titles()
+    app.stats = app.StatsAggregator(os.path.join(workdir, 'stats.json'))
+    app.stats.load()
+    app.audio_cache = app.LRUCache(app.MAX_CACHE_SIZE, app.CACHE_TIMEOUT)
+    app.audio_flight = app.SingleFlight(negative_ttl=app.NEGATIVE_CACHE_TTL)
+    app.search_cache = app.LRUCache(app.SEARCH_CACHE_SIZE, app.SEARCH_CACHE_TTL)
+    app.search_flight = app.SingleFlight()
+    app.match_cache = app.LRUCache(app.MATCH_CACHE_SIZE, app.MATCH_CACHE_TTL)
+    return workdir
+
+
+def drive(clients, requests_for):
+    """Lance `clients` threads en même temps ; chacun renvoie une liste (étiquette, statut, ms, succès)"""
+    barrier = threading.Barrier(clients)
+
+    def run(c):
+        barrier.wait()
+        return requests_for(c)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = [result for batch in pool.map(run, range(clients)) for result in batch]
+    return results, time.perf_counter() - start
+
+
+def timed_request(transport, label, method, path, body=None):
+    start = time.perf_counter()
+    status, payload = transport.request(method, path, body)
+    ok = isinstance(payload, dict) and payload.get('success') is True
+    return label, status, (time.perf_counter() - start) * 1000, ok
+
+
+def requests_report(results, duration):
+    """Débit, codes HTTP et latence, globalement et par type d'opération"""
+    statuses = {}
+    by_label = {}
+    for label, status, elapsed, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        by_label.setdefault(label, []).append(elapsed)
+    report = {
+        'requests': len(results),
+        'duration_s': round(duration, 3),
+        'rps': round(len(results) / duration, 1) if duration else 0.0,
+        'status': statuses,
+        'unsuccessful': sum(1 for *_, ok in results if not ok),  # Réponses {'success': false}
+        'latency': latency_summary([elapsed for _, _, elapsed, _ in results])
+    }
+    if len(by_label) > 1:
+        report['operations'] = {label: latency_summary(samples) for label, samples in sorted(by_label.items())}
+    return report
+
+
+def scenario_play_burst(transport, args):
+    """Rafale de /play : moitié morceaux populaires (partagés), moitié morceaux froids"""
+    hot = [f"hot{i:04d}" for i in range(args.hot)]
+    FakeYoutubeDL.reset(args.seed)
+
+    def requests_for(c):
+        rng = random.Random(args.seed + c)
+        return [
+            timed_request(transport, 'play', 'GET',
+                          f"/play/{rng.choice(hot) if rng.random() < 0.5 else f'cold{c:03d}{i:04d}'}")
+            for i in range(args.requests)
+        ]
+
+    results, duration = drive(args.clients, requests_for)
+    return {
+        **requests_report(results, duration),
+        'extractions': FakeYoutubeDL.calls,
+        'extraction_errors': FakeYoutubeDL.errors,
+        'audio_cache': app.audio_cache.metrics()
+    }
+
+
+def scenario_search_storm(transport, args):
+    """Recherches concurrentes, requêtes tirées selon une loi de Zipf (quelques requêtes très fréquentes)"""
+    queries = [f"artist {i} song {i * 7 % 101}" for i in range(args.queries)]
+    weights = [1 / (rank + 1) for rank in range(len(queries))]
+    FakeYoutubeDL.reset(args.seed)
+
+    def requests_for(c):
+        rng = random.Random(args.seed + c)
+        return [
+            timed_request(transport, 'search', 'POST', '/search', {'query': query})
+            for query in rng.choices(queries, weights, k=args.requests)
+        ]
+
+    results, duration = drive(args.clients, requests_for)
+    return {
+        **requests_report(results, duration),
+        'searches': FakeYoutubeDL.calls,
+        'search_errors': FakeYoutubeDL.errors,
+        'search_cache': app.search_cache.metrics()
+    }
+
+
+def scenario_large_import(transport, args):
+    """Import Spotify de --import-tracks morceaux, suivi jusqu'à la fin de la tâche"""
+    server = fake_spotify_server(args.import_tracks, args.spotify_latency, 0,
+                                 error_rate=args.spotify_error_rate, payload=args.payload, seed=args.seed)
+    app.spotify = app.SpotifyClient(spotify_client(server, requests_session=app.spotify_session()),
+                                    rate=1000, burst=1000)
+    FakeYoutubeDL.reset(args.seed)
+    try:
+        start = time.perf_counter()
+        status, payload = transport.request('POST', '/import-spotify',
+                                            {'url': 'https://open.spotify.com/playlist/fakeplaylist'})
+        job = {'status': 'error', 'error': (payload or {}).get('error', status)}
+        if payload and payload.get('job_id'):
+            while True:
+                _, body = transport.request('GET', f"/jobs/{payload['job_id']}")
+                job = body['job']
+                if job['status'] in ('done', 'error'):
+                    break
+                time.sleep(0.02)
+        duration = time.perf_counter() - start
+        return {
+            'status': job['status'],
+            'duration_s': round(duration, 3),
+            'tracks': args.import_tracks,
+            'resolved': job.get('resolved', 0),
+            'failed': job.get('failed', 0),
+            'tracks_per_s': round(job.get('resolved', 0) / duration, 1),
+            'spotify_requests': server.requests,
+            'spotify_kb': round(server.bytes / 1024, 1),
+            'youtube_searches': FakeYoutubeDL.calls,
+            'youtube_errors': FakeYoutubeDL.errors
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def scenario_crud(transport, args):
+    """Lectures et modifications concurrentes de la bibliothèque synthétique"""
+    names = list(app.playlists)
+
+    def requests_for(c):
+        rng = random.Random(args.seed + c)
+        own = f"Bench {c}"
+        results = [timed_request(transport, 'create', 'POST', '/playlist', {'name': own})]
+        current = own
+        for i in range(args.requests):
+            target = quote(rng.choice(names))
+            roll = rng.random()
+            if roll < 0.35:
+                results.append(timed_request(transport, 'get', 'GET', f"/playlist/{target}?offset=0&limit=100"))
+            elif roll < 0.45:
+                results.append(timed_request(transport, 'summary', 'GET', '/playlists/summary'))
+            elif roll < 0.65:
+                results.append(timed_request(transport, 'add', 'POST', f"/playlist/{target}/add",
+                                             {'id': f"b{c:03d}{i:05d}", 'title': f"Bench {c} {i}"}))
+            elif roll < 0.85:
+                results.append(timed_request(transport, 'remove', 'DELETE',
+                                             f"/playlist/{target}/remove/b{c:03d}{i - 1:05d}"))
+            else:
+                renamed = own if current != own else f"{own} bis"
+                results.append(timed_request(transport, 'rename', 'PUT', f"/playlist/{quote(current)}/rename",
+                                             {'newName': renamed}))
+                current = renamed
+        results.append(timed_request(transport, 'delete', 'DELETE', f"/playlist/{quote(current)}"))
+        return results
+
+    results, duration = drive(args.clients, requests_for)
+    return {
+        **requests_report(results, duration),
+        'playlists': len(names),
+        'songs': sum(len(app.playlists[name]) for name in names)
+    }
+
+
+def scenario_stats_flush(transport, args):
+    """Évènements d'écoute envoyés par lots puis écriture de stats.json"""
+    rng = random.Random(args.seed)
+    posts, flushes = [], []
+    for round_ in range(args.flushes):
+        events = [
+            {'id': f"v{rng.randrange(args.stats_tracks):06d}", 'seconds': 30,
+             'title': 'Bench', 'new_play': rng.random() < 0.2}
+            for _ in range(args.events_batch)
+        ]
+        posts.append(timed_request(transport, 'events', 'POST', '/stats/events', events))
+        start = time.perf_counter()
+        app.stats.flush()
+        flushes.append((time.perf_counter() - start) * 1000)
+    return {
+        'events': args.flushes * args.events_batch,
+        'post_latency': latency_summary([elapsed for _, _, elapsed, _ in posts]),
+        'unsuccessful': sum(1 for *_, ok in posts if not ok),
+        'flush_latency': latency_summary(flushes),
+        'tracks': len(app.stats.tracks),
+        'file_kb': round(os.path.getsize(app.stats.path) / 1024, 1)
+    }
+
+
+SCENARIOS = {
+    'play-burst': scenario_play_burst,
+    'search-storm': scenario_search_storm,
+    'large-import': scenario_large_import,
+    'crud': scenario_crud,
+    'stats-flush': scenario_stats_flush
+}
+
+
+def bench_suite(args):
+    """Suite complète sur backends simulés, via le client de test et un vrai serveur, résultats en JSON"""
+    use_youtube_dl(lambda opts=None: FakeYoutubeDL(
+        opts, latency=args.latency, error_rate=args.error_rate, results=args.results, payload=args.payload))
+    # Seuls les avertissements sont journalisés : la sortie JSON reste lisible et le coût des logs hors mesure
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    library = fake_library(args.playlists, args.songs)
+    config = {key: value for key, value in vars(args).items() if key != 'func'}
+    output = {
+        'config': config,
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'results': {}
+    }
+    for transport_name in args.transports:
+        results = output['results'][transport_name] = {}
+        for name in args.scenarios:
+            # Données neuves pour chaque scénario : les résultats ne dépendent pas de l'ordre
+            sandbox(library)
+            transport = TRANSPORTS[transport_name]()
+            try:
+                print(f"{transport_name} / {name}...", file=sys.stderr)
+                results[name] = SCENARIOS[name](transport, args)
+            finally:
+                transport.close()
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Résultats écrits dans {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def bench_batch(args):
+    """Ajouts unitaires contre un seul lot, fusion, puis export/import JSON lines d'une grosse playlist"""
+    logging.getLogger().setLevel(logging.WARNING)
+    workdir = sandbox(fake_library(1, args.songs))
+    client = app.app.test_client()
+    songs = [{'id': f"n{i:05d}", 'title': f"Nouveau {i}"} for i in range(args.adds)]
+
+    client.post('/playlist', json={'name': 'Unitaire'})
+    start = time.perf_counter()
+    for song in songs:
+        client.post('/playlist/Unitaire/add', json=song)
+    single = time.perf_counter() - start
+
+    client.post('/playlist', json={'name': 'Lot'})
+    start = time.perf_counter()
+    client.post('/playlist/Lot/batch', json={'operations': [{'op': 'add', 'songs': songs}]})
+    batch = time.perf_counter() - start
+    print(f"{args.adds} ajouts unitaires : {single * 1000:.0f} ms, "
+          f"en un lot : {batch * 1000:.0f} ms ({single / batch:.0f}x)")
+
+    start = time.perf_counter()
+    client.post('/playlist/Lot/merge', json={'sources': ['Unitaire']})
+    client.post('/playlist/Lot/dedupe')
+    print(f"fusion + dédoublonnage : {(time.perf_counter() - start) * 1000:.0f} ms, "
+          f"{len(app.playlists['Lot'])} morceaux")
+
+    # Retrait puis ajout du même id dans un lot : le nouveau titre doit survivre au rechargement
+    renamed = {'id': songs[0]['id'], 'title': 'Renommé'}
+    client.post('/playlist/Lot/batch', json={'operations': [
+        {'op': 'remove', 'id': renamed['id']}, {'op': 'add', 'song': renamed, 'position': 0}
+    ]})
+    stored = app.PlaylistStore(app.store.path).load_all()['Lot']
+    assert stored == app.playlists['Lot'].songs() and stored[0] == renamed, 'lot non persisté'
+
+    source = next(name for name in app.playlists if name not in ('Lot', 'Unitaire'))
+    start = time.perf_counter()
+    response = client.get(f"/playlist/{quote(source)}/export")
+    chunks = list(response.response)
+    exported = time.perf_counter() - start
+    data = b''.join(chunks)
+    print(f"export de {len(app.playlists[source])} morceaux : {exported * 1000:.0f} ms, "
+          f"{len(data) / 1024:.0f} Ko en {len(chunks)} blocs (max {max(map(len, chunks)) / 1024:.0f} Ko)")
+    response.close()
+
+    client.delete(f"/playlist/{quote(source)}")
+    start = time.perf_counter()
+    result = client.post('/playlists/import', data=data, content_type='application/x-ndjson').get_json()
+    print(f"import : {(time.perf_counter() - start) * 1000:.0f} ms, {sum(result['imported'].values())} morceaux")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_state(args):
+    """Lectures et écritures concurrentes de la bibliothèque : invariants des instantanés, débit et latence"""
+    logging.getLogger().setLevel(logging.WARNING)
+    workdir = sandbox(fake_library(args.playlists, args.songs))
+    for w in range(args.writers):
+        app.playlists.create(f"Stress {w}")
+    shared = [name for name in app.playlists if not name.startswith('Stress')]
+    count = len(app.playlists)
+    transport = TRANSPORTS[args.transport]()
+    violations = []
+    done = threading.Event()
+
+    def unique(songs):
+        return len({song['id'] for song in songs}) == len(songs)
+
+    def reader(r):
+        rng = random.Random(args.seed + r)
+        samples, last = [], -1
+        while not done.is_set():
+            roll = rng.random()
+            start = time.perf_counter()
+            if roll < 0.4:
+                label, (_, payload) = 'summary', transport.request('GET', '/playlists/summary')
+                if payload['version'] < last:
+                    violations.append(f"version {payload['version']} lue après {last}")
+                last = payload['version']
+                if len(payload['playlists']) != count:
+                    violations.append(f"{len(payload['playlists'])} playlists dans le résumé")
+            elif roll < 0.5:
+                # Le décodage de la bibliothèque entière côté lecteur coûte plus que la réponse elle-même
+                label, (_, payload) = 'playlists', transport.request('GET', '/playlists')
+                if len(payload['playlists']) != count:
+                    violations.append(f"{len(payload['playlists'])} playlists dans /playlists")
+                if not all(unique(songs) for songs in payload['playlists'].values()):
+                    violations.append('doublon dans /playlists')
+            else:
+                name = quote(rng.choice(shared))
+                label, (_, payload) = 'playlist', transport.request('GET', f"/playlist/{name}?offset=0&limit=100")
+                if not unique(payload['playlist']) or len(payload['playlist']) > payload['total']:
+                    violations.append(f"page incohérente pour {name}")
+            samples.append((label, (time.perf_counter() - start) * 1000))
+        return samples
+
+    def writer(w):
+        """Opérations sur sa propre playlist (renommée en va-et-vient) et sur les playlists partagées"""
+        rng = random.Random(args.seed + 1000 + w)
+        names = [f"Stress {w}", f"Stress {w} bis"]
+        own, expected, samples = 0, [], []
+        for i in range(args.writes):
+            roll = rng.random()
+            song = {'id': f"s{w:02d}{i:05d}", 'title': f"Stress {w} {i}"}
+            current = quote(names[own])
+            start = time.perf_counter()
+            if roll < 0.4:
+                label = 'add'
+                transport.request('POST', f"/playlist/{current}/add", song)
+                expected.append(song['id'])
+            elif roll < 0.6 and expected:
+                label = 'remove'
+                transport.request('DELETE', f"/playlist/{current}/remove/{expected.pop(0)}")
+            elif roll < 0.75:
+                label = 'rename'
+                transport.request('PUT', f"/playlist/{current}/rename", {'newName': names[1 - own]})
+                own = 1 - own
+            elif roll < 0.9:
+                label = 'shared'
+                target = quote(rng.choice(shared))
+                transport.request('POST', f"/playlist/{target}/add", song)
+                transport.request('DELETE', f"/playlist/{target}/remove/{song['id']}")
+            else:
+                label = 'batch'
+                transport.request('POST', f"/playlist/{current}/batch", {'operations': [
+                    {'op': 'add', 'song': song}, {'op': 'move', 'id': song['id'], 'to': 0}
+                ]})
+                expected.append(song['id'])
+            samples.append((label, (time.perf_counter() - start) * 1000))
+        return names[own], expected, samples
+
+    version = app.playlists.version
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.readers + args.writers) as pool:
+        readers = [pool.submit(reader, r) for r in range(args.readers)]
+        writers = [pool.submit(writer, w) for w in range(args.writers)]
+        outcomes = [future.result() for future in writers]
+        done.set()
+        reads = [sample for future in readers for sample in future.result()]
+    duration = time.perf_counter() - start
+    transport.close()
+
+    # Aucune écriture perdue, mémoire et SQLite identiques, index inverse à jour
+    snapshot = app.playlists.snapshot()
+    for name, expected, _ in outcomes:
+        ids = [song['id'] for song in snapshot.playlists[name]]
+        if sorted(ids) != sorted(expected):
+            violations.append(f"{name} : {len(ids)} morceaux au lieu de {len(expected)}")
+    stored = app.store.load_all()
+    if {name: [song['id'] for song in songs] for name, songs in stored.items()} != {
+            name: [song['id'] for song in playlist] for name, playlist in snapshot.playlists.items()}:
+        violations.append('la base SQLite diffère de la mémoire')
+    for name, playlist in snapshot.playlists.items():
+        for song in playlist:
+            if name not in app.playlists.containing(song['id']):
+                violations.append(f"index inverse : {song['id']} absent de {name}")
+                break
+
+    # Coût serveur de /playlists : sérialisation après une écriture, puis corps déjà en cache
+    client = app.app.test_client()
+    app.playlists.add_songs(shared[0], [{'id': 'render', 'title': 'Render'}])
+    costs = []
+    for _ in range(2):
+        start = time.perf_counter()
+        client.get('/playlists')
+        costs.append((time.perf_counter() - start) * 1000)
+
+    writes = [sample for *_, samples in outcomes for sample in samples]
+    print(f"{args.readers} lecteurs, {args.writers} écrivains, {duration:.2f} s : "
+          f"{len(reads) / duration:.0f} lectures/s, {len(writes) / duration:.0f} écritures/s, "
+          f"{app.playlists.version - version} versions publiées")
+    print(f"/playlists côté serveur : {costs[0]:.1f} ms après une écriture, {costs[1]:.1f} ms en cache")
+    print(f"{'opération':<10} {'nombre':>7} {'médiane':>9} {'p95':>9} {'p99':>9}")
+    for label in ('summary', 'playlists', 'playlist', 'add', 'remove', 'rename', 'shared', 'batch'):
+        durations = [ms for kind, ms in reads + writes if kind == label]
+        if durations:
+            print(f"{label:<10} {len(durations):>7} {statistics.median(durations):>6.2f} ms "
+                  f"{percentile(durations, 95):>6.2f} ms {percentile(durations, 99):>6.2f} ms")
+    shutil.rmtree(workdir, ignore_errors=True)
+    if violations:
+        print(f"{len(violations)} invariants violés, par exemple :")
+        for violation in violations[:10]:
+            print(f"  {violation}")
+        sys.exit(1)
+    print('invariants : OK')
+
+
+SYLLABLES = ['la', 'mo', 'ri', 'ka', 'ne', 'so', 'tu', 'vi', 'da', 'lo', 'mé', 'ar', 'in', 'or', 'qu', 'zé', 'bel', 'ton']
+
+
+def fake_titles(count, seed=0):
+    """Titres « morceau - artistes » tirés d'un vocabulaire inventé, mots fréquents selon Zipf"""
+    rng = random.Random(seed)
+    words = list(dict.fromkeys(
+        ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(8000)
+    ))
+    artists = [' '.join(rng.choice(words).capitalize() for _ in range(rng.randint(1, 2))) for _ in range(2000)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    return [
+        f"{' '.join(rng.choices(words, weights, k=rng.randint(1, 5))).capitalize()} - "
+        f"{', '.join(rng.sample(artists, rng.randint(1, 2)))}"
+        for _ in range(count)
+    ]
+
+
+def bench_title_index(args):
+    """Index local des titres : construction, requêtes (mots, préfixes, saisie) et mises à jour"""
+    titles = fake_titles(args.songs, args.seed)
+    songs = [{'id': f"v{i:06d}", 'title': title} for i, title in enumerate(titles)]
+    index = app.TitleIndex()
+    start = time.perf_counter()
+    index.add_many(songs)
+    print(f"{args.songs} titres indexés en {(time.perf_counter() - start) * 1000:.0f} ms, "
+          f"{index.metrics()['words']} mots distincts")
+
+    rng = random.Random(args.seed)
+    samples = [app.fold_text(rng.choice(titles)).split() for _ in range(args.queries)]
+    kinds = {
+        'mot entier': [words[0] for words in samples],
+        'préfixe 3 lettres': [words[-1][:3] for words in samples],
+        'deux mots': [' '.join(words[:2]) for words in samples],
+        'saisie (dernier mot tronqué)': [' '.join(words[:2])[:-1] for words in samples],
+        'artiste': [app.fold_text(title.split(' - ')[1]) for title in rng.sample(titles, args.queries)]
+    }
+    print(f"{'requête':<30} {'médiane':>9} {'p95':>9} {'p99':>9} {'résultats':>10}")
+    for label, queries in kinds.items():
+        durations, found = [], 0
+        for query in queries:
+            start = time.perf_counter()
+            results = index.search(query, app.SEARCH_SUGGEST_LIMIT)
+            durations.append((time.perf_counter() - start) * 1000)
+            found += bool(results)
+        print(f"{label:<30} {statistics.median(durations):>6.3f} ms {percentile(durations, 95):>6.3f} ms "
+              f"{percentile(durations, 99):>6.3f} ms {found / len(queries):>9.0%}")
+
+    updates = []
+    for i in range(args.queries):
+        song = {'id': f"new{i}", 'title': rng.choice(titles)}
+        start = time.perf_counter()
+        index.add_many([song])
+        index.discard_many([song['id']])
+        updates.append((time.perf_counter() - start) * 1000)
+    print(f"{'ajout + retrait':<30} {statistics.median(updates):>6.3f} ms {percentile(updates, 95):>6.3f} ms "
+          f"{percentile(updates, 99):>6.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='scenario', required=True)
+
+    p = sub.add_parser('import', help=bench_import.__doc__)
+    p.add_argument('--tracks', type=int, default=200)
+    p.add_argument('--latency', type=float, default=0.05)
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    p.set_defaults(func=bench_import)
+
+    p = sub.add_parser('match-cache', help=bench_match_cache.__doc__)
+    p.add_argument('--tracks', type=int, default=1000)
+    p.add_argument('--latency', type=float, default=0.05)
+    p.set_defaults(func=bench_match_cache)
+
+    p = sub.add_parser('single-flight', help=bench_single_flight.__doc__)
+    p.add_argument('--requests', type=int, default=50)
+    p.add_argument('--latency', type=float, default=0.5)
+    p.set_defaults(func=bench_single_flight)
+
+    p = sub.add_parser('storage', help=bench_storage.__doc__)
+    p.add_argument('--playlists', type=int, default=20)
+    p.add_argument('--songs', type=int, default=1000)
+    p.add_argument('--ops', type=int, default=50)
+    p.set_defaults(func=bench_storage)
+
+    p = sub.add_parser('envelope', help=bench_envelope.__doc__)
+    p.add_argument('--songs', type=int, default=5000)
+    p.add_argument('--requests', type=int, default=50)
+    p.set_defaults(func=bench_envelope)
+
+    p = sub.add_parser('extractor-pool', help=bench_extractor_pool.__doc__)
+    p.add_argument('--calls', type=int, default=200)
+    p.set_defaults(func=bench_extractor_pool)
+
+    p = sub.add_parser('stream', help=bench_stream.__doc__)
+    p.add_argument('--segments', type=float, default=3.5, help='taille du fichier amont, en segments')
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser('load', help=bench_load.__doc__)
+    p.add_argument('--clients', type=int, default=60)
+    p.add_argument('--requests', type=int, default=3)
+    p.add_argument('--latency', type=float, default=1.0)
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser('spotify', help=bench_spotify.__doc__)
+    p.add_argument('--tracks', type=int, default=2000)
+    p.add_argument('--latency', type=float, default=0.15)
+    p.add_argument('--throttle-every', type=int, default=15)
+    p.add_argument('--rate', type=float, default=app.SPOTIFY_RATE)
+    p.add_argument('--burst', type=int, default=app.SPOTIFY_BURST)
+    p.set_defaults(func=bench_spotify)
+
+    p = sub.add_parser('resync', help=bench_resync.__doc__)
+    p.add_argument('--tracks', type=int, default=1000)
+    p.add_argument('--added', type=int, default=5)
+    p.add_argument('--removed', type=int, default=3)
+    p.add_argument('--moved', type=int, default=2)
+    p.add_argument('--latency', type=float, default=0.02)
+    p.set_defaults(func=bench_resync)
+
+    p = sub.add_parser('matching', help=bench_matching.__doc__)
+    p.add_argument('--tracks', type=int, default=1000)
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_matching)
+
+    p = sub.add_parser('startup', help=bench_startup.__doc__)
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--top', type=int, default=8)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('metrics-overhead', help=bench_metrics_overhead.__doc__)
+    p.add_argument('--calls', type=int, default=100000)
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--requests', type=int, default=500)
+    p.add_argument('--budget', type=float, default=0.02, help="part maximale d'une requête (0.02 = 2 %%)")
+    p.set_defaults(func=bench_metrics_overhead)
+
+    p = sub.add_parser('title-index', help=bench_title_index.__doc__)
+    p.add_argument('--songs', type=int, default=50000)
+    p.add_argument('--queries', type=int, default=2000)
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=bench_title_index)
+
+    p = sub.add_parser('batch', help=bench_batch.__doc__)
+    p.add_argument('--songs', type=int, default=50000)
+    p.add_argument('--adds', type=int, default=200)
+    p.set_defaults(func=bench_batch)
+
+    p = sub.add_parser('state', help=bench_state.__doc__)
+    p.add_argument('--transport', choices=list(TRANSPORTS), default='client')
+    p.add_argument('--playlists', type=int, default=20)
+    p.add_argument('--songs', type=int, default=500)
+    p.add_argument('--readers', type=int, default=8)
+    p.add_argument('--writers', type=int, default=4)
+    p.add_argument('--writes', type=int, default=500, help='opérations par écrivain')
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=bench_state)
+
+    p = sub.add_parser('suite', help=bench_suite.__doc__)
+    p.add_argument('--transports', nargs='+', choices=list(TRANSPORTS), default=list(TRANSPORTS))
+    p.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    p.add_argument('--playlists', type=int, default=50)
+    p.add_argument('--songs', type=int, default=1000)
+    p.add_argument('--clients', type=int, default=16)
+    p.add_argument('--requests', type=int, default=50)
+    p.add_argument('--latency', type=float, default=0.02, help='latence YouTube simulée (s)')
+    p.add_argument('--error-rate', type=float, default=0.0, help="part des extractions YouTube en erreur")
+    p.add_argument('--results', type=int, default=20, help='résultats par recherche YouTube')
+    p.add_argument('--payload', type=int, default=0, help='octets ajoutés à chaque résultat simulé')
+    p.add_argument('--spotify-latency', type=float, default=0.02)
+    p.add_argument('--spotify-error-rate', type=float, default=0.0)
+    p.add_argument('--import-tracks', type=int, default=1000)
+    p.add_argument('--hot', type=int, default=20, help='morceaux populaires de la rafale /play')
+    p.add_argument('--queries', type=int, default=200)
+    p.add_argument('--stats-tracks', type=int, default=5000)
+    p.add_argument('--events-batch', type=int, default=50)
+    p.add_argument('--flushes', type=int, default=20)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--output', help='fichier JSON (sortie standard par défaut)')
+    p.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()